@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+import re
+import socket
+import threading
+from contextlib import contextmanager
+from cmd import run_command
+from utils import random_string
+
+# Host ports, container names and (optionally) docker networks leased per
+# verification job, so that several jobs can run on one host at once. Image
+# tags, on the other hand, stay the same from job to job so that rebuilds reuse
+# the layer cache; jobs sharing a tag take turns.
+
+lease_lock = threading.Lock()
+leased_ports = set()
+
+def lease_port():
+    while True:
+        # Let the kernel pick a free port, then make sure no other job of ours
+        # holds it between its bind and its `docker run -p`.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        with lease_lock:
+            if port not in leased_ports:
+                leased_ports.add(port)
+                return port
+
+def release_port(port):
+    with lease_lock:
+        leased_ports.discard(port)
+
+# Docker names allow [a-zA-Z0-9][a-zA-Z0-9_.-]*; image tags must be lowercase.
+def unique_name(prefix):
+    name = '%s-%s' % (prefix.replace('/', '_'), random_string(8))
+    return name.lower()
+
+# Image tags must be lowercase, of [a-z0-9_.-], and start alphanumerically.
+def image_tag(name):
+    return re.sub(r'[^a-z0-9_.-]', '_', name.lower()).lstrip('_.-')
+
+image_locks = {}
+
+def lock_image(tag):
+    with lease_lock:
+        return image_locks.setdefault(tag, threading.Lock())
+
+# An internal network has no route to the outside, so only the containers of
+# the job can talk to each other.
+def create_network(name):
+    _, err, r = run_command('docker network create --internal %s' % name, \
+            None)
+    if r != 0:
+        print('[*] Failed to create network %s' % name)
+        print(err)
+        return False
+    return True
+
+def remove_network(name):
+    run_command('docker network rm %s' % name, None)
+
+class Lease(object):
+    def __init__(self, prefix, private_network):
+        self.host_port = lease_port()
+        self.service_name = unique_name(prefix)
+        self.exploit_name = unique_name('exploit-' + prefix)
+        self.service_image = image_tag(prefix)
+        self.exploit_image = image_tag('exploit-' + prefix)
+        # Another job building the same tags could otherwise swap the images
+        # (and so the flag) under this one.
+        self.locks = [lock_image(self.service_image), \
+                      lock_image(self.exploit_image)]
+        for lock in self.locks:
+            lock.acquire()
+        self.network = None
+        if private_network:
+            network = unique_name('gitctf-net')
+            if create_network(network):
+                self.network = network
+
+    def release(self):
+        if self.network is not None:
+            remove_network(self.network)
+        for lock in reversed(self.locks):
+            lock.release()
+        release_port(self.host_port)
+
+@contextmanager
+def lease(prefix, private_network=False):
+    l = Lease(prefix, private_network)
+    try:
+        yield l
+    finally:
+        l.release()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import shlex
+import signal
+import asyncio
+from cmd import CHUNK_SIZE, Capture, MAX_OUTPUT, TIMEOUT, KILL_GRACE, category
+from cmd import get_timeout, strip_lines, signal_group
+
+# Commands of a category allowed to run at once; other categories use
+# DEFAULT_LIMIT.
+LIMITS = {'git': 8,
+          'gpg': 4,
+          'docker_build': 2,
+          'docker_run': 4,
+          'docker': 4}
+DEFAULT_LIMIT = 8
+
+async def pump(stream, capture):
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        capture.feed(chunk)
+
+# An asyncio counterpart of cmd.run_command. Commands are parsed, captured and
+# bounded by deadlines as there, without a thread per command; at most
+# `limits[category]` commands of a category run at once.
+class AsyncRunner(object):
+    def __init__(self, limits=None):
+        self.limits = dict(LIMITS)
+        self.limits.update(limits or {})
+        self.semaphores = {}
+
+    def semaphore(self, cat):
+        if cat not in self.semaphores:
+            self.semaphores[cat] = \
+                asyncio.Semaphore(self.limits.get(cat, DEFAULT_LIMIT))
+        return self.semaphores[cat]
+
+    async def run(self, command, path, quiet=False, limit=MAX_OUTPUT, tee=None,
+                  timeout=None):
+        async with self.semaphore(category(command)):
+            return await self.execute(command, path, quiet, limit, tee, \
+                    get_timeout(command, timeout))
+
+    async def execute(self, command, path, quiet, limit, tee, timeout):
+        print('run_command({}, {})'.format(command, path))
+        process = await asyncio.create_subprocess_exec(*shlex.split(command), \
+                cwd=path, stdout=asyncio.subprocess.PIPE, \
+                stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        tee_file = open(tee, 'ab') if tee is not None else None
+        output = Capture(limit, not quiet, tee_file)
+        error = Capture(limit)
+        expired = False
+        try:
+            capture = asyncio.gather(pump(process.stdout, output), \
+                    pump(process.stderr, error), process.wait())
+            try:
+                await asyncio.wait_for(asyncio.shield(capture), timeout)
+            except asyncio.TimeoutError:
+                expired = True
+                signal_group(process, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(asyncio.shield(capture), KILL_GRACE)
+                except asyncio.TimeoutError:
+                    signal_group(process, signal.SIGKILL)
+                    await capture
+            output.finish()
+        finally:
+            if tee_file is not None:
+                tee_file.close()
+        err = error.text()
+        returncode = process.returncode
+        if expired:
+            err += '[*] Timed out after %d seconds\n' % timeout
+            returncode = TIMEOUT
+        print('run_command completed with code {}.'.format(returncode))
+        return strip_lines(output.text()), err, returncode
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# An asyncio counterpart of Github. Requests run on a bounded pool of worker
+# threads sharing one keep-alive connection pool, so up to `max_in_flight`
+# requests are in flight at once. The wrapped synchronous client still does
+# the caching, pagination and rate limiting, so both can be used side by side.
+class AsyncGithub(object):
+    def __init__(self, github, max_in_flight=8):
+        self.github = github
+        self.max_in_flight = max_in_flight
+        for session in github.sessions:
+            adapter = HTTPAdapter(pool_connections=max_in_flight,
+                                  pool_maxsize=max_in_flight)
+            session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    # Run any blocking call, e.g. a helper from issue.py given `self.github`.
+    def call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, \
+                functools.partial(func, *args, **kwargs))
+
+    def get(self, query, expected_code=200):
+        return self.call(self.github.get, query, expected_code)
+
+    def post(self, query, data, expected_code=201):
+        return self.call(self.github.post, query, data, expected_code)
+
+    def put(self, query, data):
+        return self.call(self.github.put, query, data)
+
+    def patch(self, query, data):
+        return self.call(self.github.patch, query, data)
+
+    def poll(self, query):
+        return self.call(self.github.poll, query)
+
+    # Asynchronously iterate over a paginated listing (see Github.iterate).
+    def iterate(self, query, expected_code=200):
+        return self.stream(self.github.iterate(query, expected_code))
+
+    def iterate_issues(self, owner, repo, labels=None, states=('OPEN',),
+                       comments=10):
+        return self.stream(self.github.iterate_issues(owner, repo, labels, \
+                states, comments))
+
+    # Consume a blocking iterator without blocking the event loop.
+    async def stream(self, it):
+        done = object()
+        while True:
+            item = await self.call(next, it, done)
+            if item is done:
+                return
+            yield item
+
+    def close(self):
+        self.executor.shutdown(wait=True)
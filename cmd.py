@@ -22,21 +22,191 @@
 #  limitations under the License.
 
 from __future__ import print_function
-import subprocess
+import os
+import sys
+import codecs
 import shlex
+import signal
+import threading
+import subprocess
+
+CHUNK_SIZE = 64 * 1024
+MAX_OUTPUT = 1024 * 1024 # Bytes kept of each stream by default
+
+# Return code of a command killed on its deadline. Exit statuses are 0-255 and
+# signals are negative, so it cannot be confused with the command's own status,
+# such as the 124 of a timeout(1) inside launch_exploit.sh.
+TIMEOUT = 256
+KILL_GRACE = 5 # Seconds between SIGTERM and SIGKILL
+
+# Default deadlines in seconds per category of command (see category()); a
+# category missing here, or mapped to None, has no deadline. The evaluator
+# overrides them with `timeouts` in its config.
+TIMEOUTS = {'git': 600,
+            'gpg': 120,
+            'docker_build': 1800,
+            'docker_run': 600,
+            'docker': 120}
+
+def category(command):
+    args = shlex.split(command)
+    if not args:
+        return None
+    program = os.path.basename(args[0])
+    if program in ('setup_service.sh', 'launch_exploit.sh'):
+        return 'docker_build' # Builds an image, then runs it
+    if program == 'docker' and len(args) > 1:
+        if args[1] == 'build':
+            return 'docker_build'
+        if args[1] in ('run', 'exec'):
+            return 'docker_run'
+    return program
+
+# Collects the output of a stream, keeping at most `limit` bytes (unbounded if
+# None): the first and the last `limit / 2` bytes, so that both the start of a
+# long output and its final lines (e.g. the flag printed by an exploit)
+# survive. Chunks are optionally echoed to stdout and written to `tee`.
+class Capture(object):
+    def __init__(self, limit=MAX_OUTPUT, echo=False, tee=None):
+        self.half = limit // 2 if limit is not None else None
+        self.echo = echo
+        self.tee = tee
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.tail_size = 0
+        self.newline = True
+
+    def feed(self, chunk):
+        if self.tee is not None:
+            self.tee.write(chunk)
+        if self.echo:
+            sys.stdout.write(self.decoder.decode(bytes(chunk)))
+            sys.stdout.flush()
+            self.newline = chunk[-1:] == b'\n'
+        if self.half is None:
+            self.head += chunk
+            return
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if len(chunk) > 0:
+            self.tail += chunk
+            self.tail_size += len(chunk)
+            # Trim only once the tail has doubled, to keep appends amortized.
+            if len(self.tail) > 2 * self.half:
+                del self.tail[:len(self.tail) - self.half]
+
+    # End the echoed output with a newline.
+    def finish(self):
+        if self.echo and not self.newline:
+            print()
+
+    def data(self):
+        if self.half is None or self.tail_size <= self.half:
+            return bytes(self.head + self.tail)
+        omitted = self.tail_size - self.half
+        return bytes(self.head) + \
+            ('\n[... %d bytes omitted ...]\n' % omitted).encode('utf-8') + \
+            bytes(self.tail[-self.half:])
+
+    def text(self):
+        return self.data().decode('utf-8', 'replace')
+
+def pump(stream, capture):
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = stream.readinto(buf)
+        if not n:
+            break
+        capture.feed(view[:n])
+    stream.close()
+
+# Each line stripped and terminated by '\n', as run_command has always
+# returned its output.
+def strip_lines(text):
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return ''.join(line.strip() + '\n' for line in lines)
+
+def signal_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        pass # Already gone
+
+# Terminate the process group of `process` once `timeout` seconds have passed,
+# escalating to SIGKILL after KILL_GRACE seconds. Call cancel() when the
+# process is done.
+class Deadline(object):
+    def __init__(self, process, timeout):
+        self.process = process
+        self.expired = False
+        self.timer = threading.Timer(timeout, self.expire)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def expire(self):
+        self.expired = True
+        signal_group(self.process, signal.SIGTERM)
+        try:
+            self.process.wait(KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            signal_group(self.process, signal.SIGKILL)
+
+    def cancel(self):
+        self.timer.cancel()
+
+def get_timeout(command, timeout):
+    if timeout is None:
+        timeout = TIMEOUTS.get(category(command))
+    return timeout if timeout else None
 
-def run_command(command, path):
+# Run `command` in `path` and return (output, error, returncode). Each stream
+# keeps at most `limit` bytes (see Capture). Unless `quiet`, the output is
+# echoed as it arrives; `tee` is a path to which the full output is appended,
+# and `stdin` a path to a file fed to the command. The command runs in its own process group, which is killed after `timeout`
+# seconds (default: the deadline of its category; 0 for none). The return
+# code is then TIMEOUT.
+def run_command(command, path, quiet=False, limit=MAX_OUTPUT, tee=None,
+                timeout=None, stdin=None):
     print('run_command({}, {})'.format(command, path))
-    process = subprocess.Popen(shlex.split(command), cwd=path,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                               universal_newlines=True)
-    whole_output = ''
-
-    for line in iter(process.stdout.readline, ''):
-        if line:
-            print(line.strip())
-            whole_output = whole_output + line.strip()+ '\n'
-        
-    error = process.communicate()[1]
-    print('run_command completed with code {}.'.format(process.poll()))
-    return whole_output, error, process.returncode
+    timeout = get_timeout(command, timeout)
+    stdin_file = open(stdin, 'rb') if stdin is not None else None
+    try:
+        process = subprocess.Popen(shlex.split(command), cwd=path,
+                                   stdin=stdin_file, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, bufsize=0,
+                                   start_new_session=True)
+    finally:
+        if stdin_file is not None:
+            stdin_file.close()
+    deadline = Deadline(process, timeout) if timeout is not None else None
+    tee_file = open(tee, 'ab') if tee is not None else None
+    try:
+        output = Capture(limit, not quiet, tee_file)
+        error = Capture(limit)
+        # stderr is drained concurrently so that neither pipe can fill up.
+        drain = threading.Thread(target=pump, args=(process.stderr, error))
+        drain.daemon = True
+        drain.start()
+        pump(process.stdout, output)
+        output.finish()
+        drain.join()
+        process.wait()
+    finally:
+        if deadline is not None:
+            deadline.cancel()
+        if tee_file is not None:
+            tee_file.close()
+    err = error.text()
+    returncode = process.returncode
+    if deadline is not None and deadline.expired:
+        err += '[*] Timed out after %d seconds\n' % timeout
+        returncode = TIMEOUT
+    print('run_command completed with code {}.'.format(returncode))
+    return strip_lines(output.text()), err, returncode
@@ -31,6 +31,7 @@ import shutil
 import zipfile
 from utils import random_string, rmdir, rmfile, remove_trailing_slash
 from cmd import run_command
+from tracing import span
 
 def decrypt_exploit(encrypted_exploit_path, config, team, out_dir=None, \
         expected_signer=None):
@@ -57,13 +58,15 @@ def decrypt_exploit(encrypted_exploit_path, config, team, out_dir=None, \
         decrypt_cmd = "gpg --no-default-keyring --keyring %s -o %s %s" \
                 % (tmpgpg, tmpzip, encrypted_exploit_path)
 
-    _, err, r = run_command(decrypt_cmd, os.getcwd())
+    with span('gpg.decrypt', signer=expected_signer):
+        _, err, r = run_command(decrypt_cmd, os.getcwd())
     if r != 0:
         print("[*] Failed to decrypt/verify %s" % encrypted_exploit_path)
         print(err)
         return None
 
-    run_command('unzip %s -d %s' % (tmpzip, tmpdir), os.getcwd())
+    with span('unzip'):
+        run_command('unzip %s -d %s' % (tmpzip, tmpdir), os.getcwd())
     shutil.move(tmpdir, out_dir)
 
     rmfile(tmpzip)
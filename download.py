@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import os
 from utils import prompt_rmdir_warning, rmdir, mkdir, rmfile
-from github import Github
+from github import Github, LOW
+from async_github import AsyncGithub
+from async_cmd import AsyncRunner
 import re
-from cmd import run_command
 import shutil
-import random
-import time
 from tqdm import tqdm
 from pprint import pprint
 
@@ -20,26 +20,59 @@ def create_or_empty_folder(folder):
     mkdir(folder)
     
     
-def list_issues(owner, repo, github):
-    issues = github.get("/repos/{}/{}/issues?state=open&labels=verified&per_page=100".format(owner, repo))
+async def save_submission(runner, destination, issue_id, body, comments):
+    matches = re.match(r"My NetID is (\w+), and my pub key id is (\w+)", comments[0])
+    net_id = matches.group(1)
+    key_id = matches.group(2)
     
-    body = {}
+    net_id_folder = "{}/{}".format(destination, net_id)
     
-    for i in issues:
-        body[i['number']] = i['body']
+    if not os.path.isdir(net_id_folder):
+        mkdir(net_id_folder)
+        
+    issue_folder = "{}/{}/".format(net_id_folder, issue_id)
+    
+    create_or_empty_folder(issue_folder)
+    
+    with open(issue_folder + "answer.zip.pgp", "w") as f:
+        f.write(body)
+        
+    with open(issue_folder + "pub_key.asc", "w") as f:
+        f.write(comments[1])
+        
+    await runner.run("gpg --import pub_key.asc", issue_folder)
+    
+    await runner.run("gpg -o answer.zip answer.zip.pgp", issue_folder)
     
-    return body
+    await runner.run("unzip answer.zip -d ./", issue_folder)
+    
+    rmfile(issue_folder + "answer.zip")
+    
+    shutil.make_archive("{}/{}".format(net_id_folder, issue_id), "zip", issue_folder)
 
 
-def get_comments(owner, repo, issue_id, github):
-    r = github.get("/repos/{}/{}/issues/{}/comments".format(owner, repo, issue_id))
+# Issues come with their first comments from one paginated GraphQL query, so
+# no request is made per issue. Each submission is saved as soon as its issue
+# arrives, while the next pages are fetched; the runner bounds how many gpg
+# commands run at once.
+async def download(owner, repo, destination, agh):
+    runner = AsyncRunner()
+    
+    progress = tqdm()
     
-    comments = []
+    async def save(issue):
+        comments = [c['body'] for c in issue['first_comments']]
+        await save_submission(runner, destination, issue['number'], issue['body'], comments)
+        progress.update()
     
-    for comment in r:
-        comments.append(comment['body'])
+    tasks = []
     
-    return comments
+    async for issue in agh.iterate_issues(owner, repo, ['verified'], comments=2):
+        tasks.append(asyncio.ensure_future(save(issue)))
+    
+    await asyncio.gather(*tasks)
+    
+    progress.close()
     
 
 if __name__ == '__main__':
@@ -49,7 +82,8 @@ if __name__ == '__main__':
                         help="specify the GitHub user")
     
     parser.add_argument("-t", "--token", metavar="APITOKEN", required=True,
-                        help="specify the GitHub API token")
+                        help="specify the GitHub API token (or several, " \
+                             "separated by commas)")
                     
     parser.add_argument("-o", "--owner", metavar="string", required=True,
                         help="specify the repo owner")
@@ -69,42 +103,12 @@ if __name__ == '__main__':
     
     create_or_empty_folder(destination)
     
-    github = Github(args.user, args.token)
+    github = Github(args.user, args.token, priority=LOW)
     
-    issues = list_issues(args.owner, args.repo, github)
+    agh = AsyncGithub(github)
     
-    for issue_id, body in tqdm(issues.items()):
-        comments = get_comments(args.owner, args.repo, issue_id, github)
-        
-        matches = re.match(r"My NetID is (\w+), and my pub key id is (\w+)", comments[0])
-        net_id = matches.group(1)
-        key_id = matches.group(2)
-        
-        net_id_folder = "{}/{}".format(destination, net_id)
-        
-        if not os.path.isdir(net_id_folder):
-            mkdir(net_id_folder)
-            
-        issue_folder = "{}/{}/".format(net_id_folder, issue_id)
-        
-        create_or_empty_folder(issue_folder)
-        
-        with open(issue_folder + "answer.zip.pgp", "w") as f:
-            f.write(body)
-            
-        with open(issue_folder + "pub_key.asc", "w") as f:
-            f.write(comments[1])
-            
-        run_command("gpg --import pub_key.asc", issue_folder)
-        
-        run_command("gpg -o answer.zip answer.zip.pgp", issue_folder)
-        
-        run_command("unzip answer.zip -d ./", issue_folder)
-        
-        rmfile(issue_folder + "answer.zip")
-        
-        shutil.make_archive("{}/{}".format(net_id_folder, issue_id), "zip", issue_folder)
-        
-        # GitHub has a limitation for how many requests we can make per minute
-        time.sleep(random.randint(1, 3))
-    
\ No newline at end of file
+    asyncio.run(download(args.owner, args.repo, destination, agh))
+    
+    agh.close()
+
+    github.report_usage()
@@ -25,28 +25,37 @@ from __future__ import print_function
 import os
 import re
 import sys
-import csv
 import json
 import time
 import calendar
-from issue import is_closed, create_comment, close_issue
-from issue import create_label, update_label, get_github_issue
-from cmd import run_command
-from utils import load_config, rmdir, rmfile, iso8601_to_timestamp, is_timeover
-from github import Github, get_github_path
-from git import clone, checkout, get_next_commit_hash
-from verify_issue import verify_issue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from issue import fetch_issue, bootstrap_labels, transition_issue
+from cmd import run_command, TIMEOUTS
+from utils import load_config, rmdir, iso8601_to_timestamp, is_timeover
+from utils import configure_verify_log
+from github import Github, GithubError, get_github_path
+from git import clone
+from verify_issue import verify_issue, fetch_exploit
+from reverify import reverify
+from scoreboard import ScoreboardWriter
+from journal import Journal, SEEN, DECRYPTED, VERIFIED, DONE
+import image_cache
+from webhook import WebhookReceiver
+import tracing
 import argparse
 
-msg_file = 'msg' # Temporarily store commit message
+# Labels used to track the state of exploit issues: name -> (color, desc)
+LABELS = {'eval': ('DA0019', 'Exploit is under review.'),
+          'verified': ('9466CB', 'Successfully verified.'),
+          'failed': ('000000', 'Verification failed.'),
+          'defended': ('0000ff', 'Defended.')}
 
-def failure_action(repo_owner, repo_name, issue_no, comment, id, github):
-    create_label(repo_owner, repo_name, "failed", "000000", \
-            "Verification failed.", github)
-    update_label(repo_owner, repo_name, issue_no, github, "failed")
-    create_comment(repo_owner, repo_name, issue_no, comment, github)
-    close_issue(repo_owner, repo_name, issue_no, github)
-    mark_as_read(id, github)
+def failure_action(repo_owner, repo_name, issue_no, comment, id, github,
+                   issue=None):
+    return transition_issue(repo_owner, repo_name, issue_no, github, \
+            labels=['failed'], state='closed', comment=comment, \
+            snapshot=issue, after=[lambda: mark_as_read(id, github)])
 
 def get_target_repos(config):
     repos = []
@@ -69,23 +78,40 @@ def get_issue_id(noti):
 def get_issue_gen_time(noti):
     return iso8601_to_timestamp(noti['updated_at'])
 
-def get_issues(target_repos, github):
-    issues = []
+def prepare_labels(repo_owner, target_repos, github):
+    for repo in target_repos:
+        if repo != '-':
+            bootstrap_labels(repo_owner, repo, LABELS, github)
+
+# Record the notifications updated since the journal's cursor and return all
+# outstanding issues, including those seen by earlier polls (or runs) that are
+# not done yet.
+def get_issues(target_repos, github, journal):
     query = '/notifications'
+    since = journal.get_cursor('notifications')
+    if since is not None:
+        query += '?since=' + since
     try:
         notifications, interval = github.poll(query)
     except ConnectionError as err:
         print(err)
         return [], 60
+    latest = since
     for noti in reversed(notifications):
         if noti['unread'] and is_issue(noti) and is_target(noti, target_repos):
             num = get_issue_number(noti)
             id = get_issue_id(noti)
             gen_time = get_issue_gen_time(noti)
-            issues.append((noti['repository']['name'], num, id, gen_time))
-    return issues, interval
+            journal.record(noti['repository']['name'], num, id, gen_time)
+        if latest is None or noti['updated_at'] > latest:
+            latest = noti['updated_at']
+    if latest != since:
+        journal.set_cursor('notifications', latest)
+    return journal.outstanding(), interval
 
 def mark_as_read(issue_id, github):
+    if not issue_id: # Issues received through a webhook have no thread.
+        return False
     query = '/notifications/threads/' + issue_id
     return github.patch(query, None)
 
@@ -98,128 +124,64 @@ def get_defender(config, target_repo):
             break
     return defender
 
-def sync_scoreboard(scoreboard_dir):
-    run_command('git reset --hard', scoreboard_dir)
-    run_command('git pull', scoreboard_dir)
-
-def write_score(stamp, info, scoreboard_dir, pts):
-    with open(os.path.join(scoreboard_dir, 'score.csv'), 'a') as f:
-        attacker = info['attacker']
-        defender = info['defender']
-        branch = info['branch']
-        kind = info['bugkind']
-        f.write('%s,%s,%s,%s,%s,%d\n' % (stamp, attacker, defender, branch, \
-                kind, pts))
-
-def write_message(info, scoreboard_dir, pts):
-    with open(os.path.join(scoreboard_dir, msg_file), 'w') as f:
-        attacker = info['attacker']
-        defender = info['defender']
-        branch = info['branch']
-        kind = info['bugkind']
-        f.write('[Score] %s +%d\n\n' % (attacker, pts))
-        if pts == 0: # Protocol to indicate successfull defense
-            f.write('%s defended `%s` %s with %s' % (defender, branch, attacker, kind))
-        else:
-            f.write('%s attacked `%s` %s of %s' % (attacker, branch, kind, defender))
-
-def commit_and_push(scoreboard_dir):
-    _, _, r = run_command('git add score.csv', scoreboard_dir)
-    if r != 0:
-        print('[*] Failed to git add score.csv.')
-        return False
-    _, _, r = run_command('git commit -F %s' % msg_file, scoreboard_dir)
-    if r != 0:
-        print('[*] Failed to commit score.csv.')
-        return False
-    _, _, r = run_command('git push origin master', scoreboard_dir)
-    if r != 0:
-        print('[*] Failed to push the score.')
-        return False
-    rmfile(os.path.join(scoreboard_dir, msg_file))
-    return True
-
-def find_the_last_attack(scoreboard_dir, timestamp, info):
-    last_commit = None
-    scoreboard_path = os.path.join(scoreboard_dir, 'score.csv')
-    if os.path.isfile(scoreboard_path):
-        with open(scoreboard_path) as f:
-            reader = csv.reader(f, delimiter=',')
-            for row in reader:
-                if len(row) < 6:
-                    continue
-                if int(row[0]) >= timestamp and len(row[4]) == 40:
-                    if row[1] == info['attacker'] and row[2] == info['defender']:
-                        if row[3] == info['branch']:
-                            last_commit = row[4]
-    return last_commit
-
-def get_next_commit(last_commit, defender, branch, config):
-    repo_name = config['teams'][defender]['repo_name']
-    rmdir(repo_name)
-    clone(config['repo_owner'], repo_name)
-    next_commit_hash = get_next_commit_hash(repo_name, branch, last_commit)
-    rmdir(repo_name)
-    print(next_commit_hash)
-    if next_commit_hash == '':
-        return None
-    else:
-        return next_commit_hash
-
-# XXX: Calling verify_issue() multiple times involves redundant process
-# internally. We may consider replacing this by calling fetch() once and then
-# calling verify_exploit() multiple times.
-def process_unintended(repo_name, num, config, gen_time, info, scoreboard, id,
-                        github, repo_owner):
+# Score the commits the exploit still works on. Returns the commit that
+# defeats it, if any, along with the rows queued: [stamp, commit, points] for
+# each vulnerable commit, then the zero-point row of the defense.
+def process_unintended(repo_name, config, gen_time, info, scoreboard,
+                       repo_owner, exploit_dir):
     unintended_pts = config['unintended_pts']
-    target_commit = find_the_last_attack(scoreboard, gen_time, info)
+    target_commit = scoreboard.find_the_last_attack(gen_time, info)
 
     if target_commit is None:
         # This exploit is previously unseen, give point.
-        write_score(gen_time, info, scoreboard, unintended_pts)
-        write_message(info, scoreboard, unintended_pts)
-        commit_and_push(scoreboard)
-    else:
-        while True:
-            target_commit = get_next_commit(target_commit, \
-                    info['defender'], info['branch'], config)
-            if target_commit is None:
-                print('[*] No more commit to verify against')
-                break
-
-            _, verified_commit, _, _ = \
-                verify_issue(info['defender'], repo_name, num, config, \
-                github, target_commit)
-            info['bugkind'] = target_commit
-            if verified_commit is None:
-                # Found a correct patch that defeats the exploit.
-                current_time = int(time.time())
-                write_score(current_time, info, scoreboard, 0)
-                write_message(info, scoreboard, 0)
-                commit_and_push(scoreboard)
-                mark_as_read(id, github)
-                create_label(repo_owner, repo_name, "defended", "0000ff", \
-                        "Defended.", github)
-                update_label(repo_owner, repo_name, num, github, "defended")
-                break
-            else:
-                # Exploit still works on this commit, update score and continue
-                write_score(gen_time, info, scoreboard, unintended_pts)
-                write_message(info, scoreboard, unintended_pts)
-                commit_and_push(scoreboard)
-
-def process_issue(repo_name, num, id, config, gen_time, github, scoreboard):
+        scoreboard.append(gen_time, info, unintended_pts)
+        return [], None
+
+    vulnerable, defending = reverify(exploit_dir, repo_owner, repo_name, \
+            info['branch'], target_commit, config)
+
+    # Exploit still works on these commits, update score for each of them
+    rows = [[gen_time, commit, unintended_pts] for commit in vulnerable]
+
+    if defending is None:
+        print('[*] No more commit to verify against')
+        queue_rows(scoreboard, info, rows)
+        return rows, None
+
+    # Found a correct patch that defeats the exploit.
+    rows.append([int(time.time()), defending, 0])
+    queue_rows(scoreboard, info, rows)
+    return rows, defending
+
+def queue_rows(scoreboard, info, rows):
+    for stamp, commit, pts in rows:
+        info['bugkind'] = commit
+        scoreboard.append(stamp, info, pts)
+
+def finish_job(journal, job, github, repo_owner):
+    exploit = job.data.get('exploit')
+    if exploit is not None:
+        rmdir(exploit[3])
+    journal.advance(job, DONE)
+    github.release_issue(repo_owner, job.repo, job.num)
+
+# The issue is processed as a job of the journal, which keeps the decrypted
+# exploit and the verification result. A job interrupted by a restart resumes
+# after its last completed step instead of decrypting and verifying again.
+def process_issue(repo_name, num, id, config, gen_time, github, scoreboard,
+                  journal):
     repo_owner = config['repo_owner']
-    if is_closed(repo_owner, repo_name, num, github):
-        mark_as_read(id, github)
+    job = journal.record(repo_name, num, id, gen_time)
+    if job.state == DONE:
+        mark_as_read(job.thread, github)
         return
 
-
-    title, _, _, _ = get_github_issue(repo_owner, repo_name, num, github)
-
-    create_label(repo_owner, repo_name, "eval", "DA0019", \
-            "Exploit is under review.", github)
-    update_label(repo_owner, repo_name, num, github, "eval")
+    # Fetched once and passed along; regarded as closed if it cannot be read.
+    issue = fetch_issue(repo_owner, repo_name, num, github)
+    if issue is None or issue.closed:
+        mark_as_read(job.thread, github)
+        finish_job(journal, job, github, repo_owner)
+        return
 
     defender = get_defender(config, repo_name)
     if defender is None:
@@ -227,64 +189,217 @@ def process_issue(repo_name, num, id, config, gen_time, github, scoreboard):
         sys.exit()
         return
 
-    branch, commit, attacker, log = verify_issue(defender, repo_name, num, \
-            config, github)
-    if branch is None:
-        log = "```\n" + log + "```"
-        failure_action(repo_owner, repo_name, num, \
-                log + '\n\n[*] The exploit did not work.', id, github)
-        return
+    exploit = job.data.get('exploit')
+    if exploit is None or not os.path.isdir(exploit[3]):
+        if job.state == SEEN:
+            transition_issue(repo_owner, repo_name, num, github, \
+                    labels=['eval'], snapshot=issue)
+        exploit = fetch_exploit(defender, repo_name, num, config, github, issue)
+        state = job.state if job.state == VERIFIED else DECRYPTED
+        journal.advance(job, state, exploit=exploit)
+    else:
+        print('[*] Resuming issue #%s of %s (%s)' % (num, repo_name, job.state))
 
-    if config['individual'][attacker]['team'] == defender:
-        failure_action(repo_owner, repo_name, num, \
-                '[*] Self-attack is not allowed: %s.' % attacker, \
-                id, github)
-        return
+    verify_and_score(repo_name, num, job.thread, config, job.gen_time, github, \
+            scoreboard, defender, exploit, issue, journal, job)
 
-    create_label(repo_owner, repo_name, "verified", "9466CB", \
-            "Successfully verified.", github)
-    update_label(repo_owner, repo_name, num, github, "verified")
-    create_comment(repo_owner, repo_name, num, "This submission has been verified. Well done!", github)
+def verify_and_score(repo_name, num, id, config, gen_time, github, scoreboard,
+                     defender, exploit, issue, journal, job):
+    repo_owner = config['repo_owner']
+    if job.state == VERIFIED:
+        branch, commit, attacker = job.data['verified']
+    else:
+        branch, commit, attacker, log = verify_issue(defender, repo_name, \
+                num, config, github, exploit=exploit)
+        if branch is None:
+            log = "```\n" + log.summary() + "```"
+            if failure_action(repo_owner, repo_name, num, \
+                    log + '\n\n[*] The exploit did not work.', id, github, \
+                    issue):
+                finish_job(journal, job, github, repo_owner)
+            return
+
+        if config['individual'][attacker]['team'] == defender:
+            if failure_action(repo_owner, repo_name, num, \
+                    '[*] Self-attack is not allowed: %s.' % attacker, \
+                    id, github, issue):
+                finish_job(journal, job, github, repo_owner)
+            return
+
+        transition_issue(repo_owner, repo_name, num, github, \
+                labels=['verified'], \
+                comment="This submission has been verified. Well done!", \
+                snapshot=issue)
+        journal.advance(job, VERIFIED, verified=[branch, commit, attacker])
 
     kind = commit
     info = {'attacker': attacker, 'defender': defender,
             'branch': branch, 'bugkind': kind}
-    sync_scoreboard(scoreboard)
-    process_unintended(repo_name, num, config, gen_time, info, scoreboard,
-            id, github, repo_owner)
+    scoreboard.sync()
+    defending = job.data.get('defending')
+    if defending is None:
+        rows, defending = process_unintended(repo_name, config, gen_time, \
+                info, scoreboard, repo_owner, exploit[3])
+        if defending is None:
+            return
+        journal.advance(job, VERIFIED, rows=rows, defending=defending)
+    else:
+        # Rows queued but never pushed before a restart are lost with the
+        # local scoreboard; queue again those the pulled one is missing.
+        rows = [row for row in job.data.get('rows', []) \
+                if not scoreboard.has_row(row[0], info, row[1])]
+        queue_rows(scoreboard, info, rows)
+
+    # The issue is closed only once the defense is on the scoreboard;
+    # otherwise the job is resumed from here on the next poll.
+    if not scoreboard.flush():
+        print('[*] Defense of #%s not pushed yet; retrying later.' % num)
+        return
+    if transition_issue(repo_owner, repo_name, num, github, \
+            labels=['defended'], snapshot=issue, \
+            after=[lambda: mark_as_read(id, github)]):
+        finish_job(journal, job, github, repo_owner)
 
-def prepare_scoreboard_repo(url):
+def prepare_scoreboard_repo(url, config):
     path = get_github_path(url).split('/')
     scoreboard_owner = path[0]
     scoreboard_name = path[1]
     scoreboard_dir = '.score'
     clone(scoreboard_owner, scoreboard_name, False, scoreboard_dir)
-    return scoreboard_dir
-
-def start_eval(config, github):
-    target_repos = get_target_repos(config)
-    scoreboard = prepare_scoreboard_repo(config['score_board'])
+    return ScoreboardWriter(scoreboard_dir,
+                            config.get('score_batch_size', 16),
+                            config.get('score_batch_delay', 10))
+
+def get_pool_size(config, workers=None):
+    if workers is None:
+        workers = config.get('eval_workers')
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return max(1, int(workers))
+
+# Issues against the same defender share the checkout directory of the
+# defender's repository, so they are processed one after another (in the order
+# of the notifications) by a single worker. Different defenders run in parallel.
+def group_by_repo(issues):
+    groups = []
+    index = {}
+    for issue in issues:
+        repo = issue[0]
+        if repo not in index:
+            index[repo] = len(groups)
+            groups.append([])
+        groups[index[repo]].append(issue)
+    return groups
+
+# A GitHub failure only aborts the issue at hand. Its notification stays
+# unread, so the issue is picked up again by a later poll.
+def process_issues(issues, config, github, scoreboard, journal):
+    for repo, num, id, gen_time in issues:
+        try:
+            with tracing.span('issue', repo=repo, issue=num):
+                process_issue(repo, num, id, config, gen_time, github,
+                              scoreboard, journal)
+        except GithubError as e:
+            print('[*] Failed to process %s#%s: %s' % (repo, num, e))
+
+def dispatch_issues(pool, issues, config, github, scoreboard, journal):
+    futures = []
+    for group in group_by_repo(issues):
+        futures.append(pool.submit(process_issues, group, config, github, \
+                scoreboard, journal))
+    for future in futures:
+        future.result()
+
+def poll_loop(config, github, pool, scoreboard, journal, target_repos):
     finalize = False
     while (not finalize):
         if (is_timeover(config)):
             finalize = True
-        issues, interval = get_issues(target_repos, github)
+        try:
+            issues, interval = get_issues(target_repos, github, journal)
+        except GithubError as e:
+            print('[*] Failed to poll notifications: %s' % e)
+            issues, interval = [], 60
         if not issues:
             print('[*] No news. Sleep for %d seconds.' % interval)
             time.sleep(interval)
             continue
         print('[*] %d new issues.' % len(issues))
-        for repo, num, id, gen_time in issues:
-            process_issue(repo, num, id, config, gen_time, github, scoreboard)
+        dispatch_issues(pool, issues, config, github, scoreboard, journal)
+        github.report_usage()
+
+# Issues arrive through webhooks as soon as they are opened. Notifications are
+# still polled every `webhook_reconcile_interval` seconds to pick up dropped
+# deliveries and the verified issues tracked for unintended bugs.
+def webhook_loop(config, github, pool, scoreboard, journal, target_repos,
+                 port):
+    secret = config.get('webhook_secret')
+    if not secret:
+        print('[*] Fatal error: webhook_secret is not set in config.')
+        sys.exit()
+    reconcile_interval = config.get('webhook_reconcile_interval', 600)
+    receiver = WebhookReceiver(port, secret, target_repos)
+    receiver.start()
+    next_poll = 0
+    finalize = False
+    try:
+        while (not finalize):
+            if (is_timeover(config)):
+                finalize = True
+            if time.time() >= next_poll:
+                try:
+                    issues, _ = get_issues(target_repos, github, journal)
+                except GithubError as e:
+                    print('[*] Failed to poll notifications: %s' % e)
+                    issues = []
+                for issue in issues:
+                    receiver.queue.put(issue)
+                next_poll = time.time() + reconcile_interval
+            issues = receiver.queue.get_batch(max(0, next_poll - time.time()))
+            if issues:
+                print('[*] %d new issues.' % len(issues))
+                dispatch_issues(pool, issues, config, github, scoreboard, \
+                        journal)
+                github.report_usage()
+    finally:
+        receiver.stop()
+
+def start_eval(config, github, workers=None, webhook_port=None):
+    TIMEOUTS.update(config.get('timeouts', {}))
+    tracing.configure(config.get('trace_file')) # e.g. '.trace.jsonl'
+    image_cache.configure(config.get('image_cache_size', 0))
+    configure_verify_log(config.get('verify_log', '.verify.log'), \
+            output_dir=config.get('verify_output_dir', '.verify-output'))
+    target_repos = get_target_repos(config)
+    prepare_labels(config['repo_owner'], target_repos, github)
+    scoreboard = prepare_scoreboard_repo(config['score_board'], config)
+    journal = Journal(config.get('journal', '.journal.db'))
+    pool_size = get_pool_size(config, workers)
+    print('[*] Evaluating with %d worker(s).' % pool_size)
+    pool = ThreadPoolExecutor(max_workers=pool_size)
+    try:
+        if webhook_port is None:
+            poll_loop(config, github, pool, scoreboard, journal, target_repos)
+        else:
+            webhook_loop(config, github, pool, scoreboard, journal, \
+                    target_repos, webhook_port)
+    finally:
+        pool.shutdown(wait=True)
+        scoreboard.close()
+        journal.close()
     print('[*] Time is over!')
     return
 
-def evaluate(config_file, token):
+def evaluate(config_file, token, workers=None, webhook_port=None):
     # reload(sys)
     # sys.setdefaultencoding('utf-8')
     config = load_config(config_file)
-    github = Github(config['player'], token)
-    return start_eval(config, github)
+    github = Github(config['player'], token,
+                    cache_dir=config.get('github_cache_dir'))
+    return start_eval(config, github, workers, webhook_port)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='evaluate participants')
@@ -307,10 +422,18 @@ if __name__ == '__main__':
 
     github = Github(config['player'], args.token)
     
-    scoreboard = prepare_scoreboard_repo(config['score_board'])
+    scoreboard = prepare_scoreboard_repo(config['score_board'], config)
+
+    prepare_labels(config['repo_owner'], [args.repo], github)
 
     # load comments
-    comments = github.get("/repos/{}/{}/issues/{}/comments".format(config['repo_owner'], args.repo, args.issue))
+    issue = github.get_issue_with_comments(config['repo_owner'], args.repo, args.issue, 2)
+
+    if issue is None:
+        print('[*] Failed to load issue #%s of %s' % (args.issue, args.repo))
+        sys.exit(1)
+
+    comments = issue['first_comments']
 
     github_name = comments[0]['user']['login']
 
@@ -342,5 +465,11 @@ if __name__ == '__main__':
 
     issues = [(args.repo, args.issue, 0, int(time.time()))]
 
+    journal = Journal(config.get('journal', '.journal.db'))
+
     for repo, num, id, gen_time in issues:
-            process_issue(repo, num, id, config, gen_time, github, scoreboard)
+            process_issue(repo, num, id, config, gen_time, github, scoreboard,
+                          journal)
+
+    scoreboard.close()
+    journal.close()
@@ -26,32 +26,52 @@ import os
 import sys
 import json
 import time
-from evaluate import get_target_repos
-from utils import prompt_warning, load_config, rmdir
-from git import clone, list_branches, checkout
-from git import get_latest_commit_hash
+import asyncio
+from utils import prompt_warning, load_config
+from git import update_mirror_async, list_mirror_branches_async
 from github import Github
+from async_cmd import AsyncRunner
 
+# The latest commit of each bug branch of a team, read from the team's mirror
+# (whose branches track the remote ones).
+async def get_team_hashes(runner, repo_owner, repo_name, bug_branches, before):
+    print('[*] Get the commit hash of %s repo.' % repo_name)
+    mirror = await update_mirror_async(repo_owner, repo_name, runner)
+    if mirror is None:
+        sys.exit()
+    branches = list(bug_branches) if len(bug_branches) > 0 \
+        else await list_mirror_branches_async(mirror, runner)
+    if "master" in branches:
+        branches.remove("master") # Do not consider master branch
+    results = await asyncio.gather(*[runner.run('git -C %s rev-list ' \
+            '--max-count=1 --before=%d %s' % (mirror, before, branch), \
+            os.getcwd(), quiet=True) for branch in branches])
+    hashes = {}
+    for branch, (output, err, r) in zip(branches, results):
+        if r != 0:
+            print("[*] Failed to get the latest commit of %s" % branch)
+            print(err)
+            sys.exit()
+        hashes[branch] = output.strip()
+    return hashes
 
-def start_get_hash(config, github, config_file):
+# All teams are handled at once; the runner bounds how many git commands run
+# at the same time.
+async def get_all_hashes(config):
+    runner = AsyncRunner()
     repo_owner = config['repo_owner']
-    for team in config['teams']:
-        repo_name = config['teams'][team]['repo_name']
-        if repo_name == '-':
-            continue
+    before = int(time.time())
+    teams = [team for team in config['teams'] \
+             if config['teams'][team]['repo_name'] != '-']
+    results = await asyncio.gather(*[get_team_hashes(runner, repo_owner, \
+            config['teams'][team]['repo_name'], \
+            config['teams'][team]['bug_branches'], before) for team in teams])
+    return dict(zip(teams, results))
 
-        print('[*] Get the commit hash of %s repo.' % repo_name)
-        bug_branches = config['teams'][team]['bug_branches']
-        clone(repo_owner, repo_name)
-        branches = bug_branches if len(bug_branches) > 0 \
-            else list_branches(repo_name)
-        if "master" in branches:
-            branches.remove("master") # Do not consider master branch
-        for branch in branches:
-            checkout(repo_name, branch)
-            hash = get_latest_commit_hash(repo_name, int(time.time()), branch)
-            config['teams'][team][branch] = hash
-        rmdir(repo_name)
+def start_get_hash(config, github, config_file):
+    hashes = asyncio.run(get_all_hashes(config))
+    for team in hashes:
+        config['teams'][team].update(hashes[team])
 
     with open(config_file, 'w') as outfile:
         json.dump(config, outfile, indent=4)
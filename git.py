@@ -24,8 +24,15 @@
 from __future__ import print_function
 import os
 import sys
+import fcntl
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
 from cmd import run_command
-from utils import base_dir, prompt_rmdir_warning, rmdir
+from tracing import span
+from utils import base_dir, prompt_rmdir_warning, rmdir, mkdir
+
+# Local bare mirrors of team repositories, keyed by repo_owner/repo_name.
+MIRROR_DIR = '.mirror'
 
 def list_branches(dir):
     external_path = os.path.join(base_dir(), "list_branches.sh")
@@ -33,20 +40,125 @@ def list_branches(dir):
     branches = s.splitlines()
     return branches
 
-def clone(repo_owner, repo_name, prompt=False, target_dir=None):
+def get_mirror_path(repo_owner, repo_name):
+    return os.path.abspath(os.path.join(MIRROR_DIR, repo_owner, \
+            repo_name + '.git'))
+
+# Jobs in other threads or processes may share a mirror. Fetching takes the
+# lock exclusively, while cloning from the mirror only needs a shared lock.
+@contextmanager
+def lock_mirror(mirror_path, exclusive):
+    with open(mirror_path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# lock_mirror() for coroutines: the lock is waited for in an executor thread so
+# that the event loop keeps running other jobs meanwhile.
+@asynccontextmanager
+async def lock_mirror_async(mirror_path, exclusive):
+    loop = asyncio.get_running_loop()
+    with open(mirror_path + '.lock', 'a') as f:
+        await loop.run_in_executor(None, fcntl.flock, f, \
+                fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# Returns the path of the mirror, or None if it could not be updated. A failed
+# fetch leaves an existing mirror alone, as the next fetch may well succeed;
+# only a mirror that could not even be created is removed.
+def update_mirror(repo_owner, repo_name):
+    url = 'git@github.com:%s/%s' % (repo_owner, repo_name)
+    mirror = get_mirror_path(repo_owner, repo_name)
+    mkdir(os.path.dirname(mirror))
+    with lock_mirror(mirror, True), span('git.fetch', repo=repo_name):
+        created = not os.path.isdir(mirror)
+        if not created:
+            _, err, r = run_command("git -C %s fetch --prune origin" % mirror, \
+                    os.getcwd())
+        else:
+            _, err, r = run_command("git clone --bare %s %s" % (url, mirror), \
+                    os.getcwd())
+            if r == 0:
+                # Only track branches; a plain bare clone never updates them.
+                _, err, r = run_command("git -C %s config " \
+                        "remote.origin.fetch +refs/heads/*:refs/heads/*" % \
+                        mirror, os.getcwd())
+        if r != 0:
+            print('[*] Failed to update the mirror of "%s"' % url)
+            print(err)
+            if created:
+                rmdir(mirror)
+            return None
+    return mirror
+
+# The asyncio counterpart of update_mirror(), running git through an
+# async_cmd.AsyncRunner so that many mirrors can be updated at once.
+async def update_mirror_async(repo_owner, repo_name, runner):
+    url = 'git@github.com:%s/%s' % (repo_owner, repo_name)
+    mirror = get_mirror_path(repo_owner, repo_name)
+    mkdir(os.path.dirname(mirror))
+    async with lock_mirror_async(mirror, True):
+        with span('git.fetch', repo=repo_name):
+            created = not os.path.isdir(mirror)
+            if not created:
+                _, err, r = await runner.run("git -C %s fetch --prune " \
+                        "origin" % mirror, os.getcwd(), quiet=True)
+            else:
+                _, err, r = await runner.run("git clone --bare %s %s" % \
+                        (url, mirror), os.getcwd(), quiet=True)
+                if r == 0:
+                    _, err, r = await runner.run("git -C %s config " \
+                            "remote.origin.fetch " \
+                            "+refs/heads/*:refs/heads/*" % mirror, \
+                            os.getcwd(), quiet=True)
+            if r != 0:
+                print('[*] Failed to update the mirror of "%s"' % url)
+                print(err)
+                if created:
+                    rmdir(mirror)
+                return None
+    return mirror
+
+# Branches of a mirror other than master.
+async def list_mirror_branches_async(mirror, runner):
+    output, _, _ = await runner.run("git -C %s for-each-ref " \
+            "--format=%%(refname:lstrip=2) refs/heads" % mirror, os.getcwd(), \
+            quiet=True)
+    return [b for b in output.split() if b not in ('master', 'HEAD')]
+
+def clone(repo_owner, repo_name, prompt=False, target_dir=None, cached=False):
     target = repo_name if target_dir is None else target_dir
     if prompt:
         prompt_rmdir_warning(target)
     rmdir(target)
     url = 'git@github.com:%s/%s' % (repo_owner, repo_name)
-    _, err, r = run_command("git clone %s %s" % (url, target), os.getcwd())
+    # Working copies cloned from a local mirror share its objects through hard
+    # links, so only the incremental fetch goes over the network.
+    mirror = update_mirror(repo_owner, repo_name) if cached else None
+    if mirror is not None:
+        with lock_mirror(mirror, False), \
+                span('git.clone', repo=repo_name, cached=True):
+            _, err, r = run_command("git clone %s %s" % (mirror, target), \
+                    os.getcwd())
+    else:
+        # Without a usable mirror, clone straight from GitHub.
+        with span('git.clone', repo=repo_name, cached=False):
+            _, err, r = run_command("git clone %s %s" % (url, target), \
+                    os.getcwd())
     if r!= 0:
         print('[*] Failed to clone: "%s"' % url)
         print(err)
         sys.exit()
 
 def checkout(dir, br):
-    _, err, r = run_command("git -C %s checkout -f %s" % (dir, br), os.getcwd())
+    with span('git.checkout', ref=br):
+        _, err, r = run_command("git -C %s checkout -f %s" % (dir, br), \
+                os.getcwd())
     if r != 0:
         print("[*] Failed to checkout the branch %s" % br)
         print(err)
@@ -62,13 +174,12 @@ def get_latest_commit_hash(dir, create_time, branch='master'):
         sys.exit()
     return output.strip()
 
-def get_next_commit_hash(dir, branch, commit_hash):
+def get_ancestry_path(dir, branch, commit_hash):
     command = 'git -C %s rev-list --reverse --ancestry-path %s..origin/%s' \
             % (dir, commit_hash, branch)
     output, err, r = run_command(command, os.getcwd())
     if r != 0:
-        print("[*] Failed to get the next commit after %s" % commit_hash)
+        print("[*] Failed to get the commits after %s" % commit_hash)
         print(err)
         sys.exit()
-    output = output.split('\n')[0]
-    return output.strip()
+    return [line.strip() for line in output.split('\n') if line.strip()]
@@ -36,6 +36,8 @@ from show_score import show_score
 from evaluate import evaluate
 from get_hash import get_hash
 from setup_env import setup_env
+from github import GithubError
+from tracing import report
 
 def add_exploit(parser):
     parser.add_argument("--exploit", metavar="DIR", required=True,
@@ -79,7 +81,8 @@ def add_admin_conf(parser):
 
 def add_token(parser, required):
     parser.add_argument("--token", metavar="APITOKEN", required=required,
-                        help="specify the GitHub API token")
+                        help="specify the GitHub API token (or several, " \
+                             "separated by commas)")
 
 def add_confirm(parser):
     parser.add_argument("--confirm", metavar="CONFIRM", type=bool,
@@ -201,8 +204,23 @@ def eval_main(prog, options):
     parser = argparse.ArgumentParser(description=desc, prog=prog)
     add_conf(parser)
     add_token(parser, True)
+    parser.add_argument("--workers", metavar="NUM", type=int, default=None,
+            help="specify the number of issues verified in parallel " \
+                 "(default: 'eval_workers' in config, or the number of cores)")
+    parser.add_argument("--webhook-port", metavar="NUM", type=int,
+            default=None,
+            help="receive issue webhooks on this port instead of polling " \
+                 "notifications (requires 'webhook_secret' in config)")
     args = parser.parse_args(options)
-    return evaluate(args.conf, args.token)
+    return evaluate(args.conf, args.token, args.workers, args.webhook_port)
+
+def trace_main(prog, options):
+    desc = 'show where the evaluator spends its time'
+    parser = argparse.ArgumentParser(description=desc, prog=prog)
+    parser.add_argument("--file", metavar="FILE", default=".trace.jsonl",
+                        help="specify the trace file (default: .trace.jsonl)")
+    args = parser.parse_args(options)
+    return report(args.file)
 
 def exec_service_main(prog, options):
     desc = 'execute a service'
@@ -261,6 +279,7 @@ def print_usage():
     print('    hash      : get hash of each branch (for administrative purpose)')
     print('    eval      : manage the game score (for administrative purpose)')
     print('    setup     : setup the CTF env. (for administrative purpose)')
+    print('    trace     : show the time spent per evaluation phase')
     sys.exit()
 
 def print_logo():
@@ -292,6 +311,8 @@ def main(action, options):
         return eval_main(sys.argv[0] + ' eval', options)
     elif action == 'setup':
         return setup_main(sys.argv[0] + ' setup', options)
+    elif action == 'trace':
+        return trace_main(sys.argv[0] + ' trace', options)
     else:
         print('Unknown action.')
         return 'Unknown action.'
@@ -300,4 +321,9 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print_logo()
         print_usage()
-    exit_main(main(sys.argv[1], sys.argv[2:]))
+    try:
+        result = main(sys.argv[1], sys.argv[2:])
+    except GithubError as e:
+        print('[*] %s' % e)
+        sys.exit(-1)
+    exit_main(result)
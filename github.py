@@ -28,6 +28,14 @@ import json
 import requests
 import getpass
 import base64
+import hashlib
+import os
+import re
+import time
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 def decode_content(response):
     if response['encoding'] == 'base64':
@@ -54,6 +62,30 @@ def get_github_path(url):
     repo_name = trim_dot_git(grp[1])
     return (owner + '/' + repo_name) # We just call this `GitHub path`
 
+def next_link(r):
+    for link in requests.utils.parse_header_links(r.headers.get('Link', '')):
+        if link.get('rel') == 'next':
+            return link['url']
+    return None
+
+# Raised when GitHub cannot be reached or keeps failing. `status` is None when
+# no response was received at all.
+class GithubError(Exception):
+    def __init__(self, method, url, status, content):
+        Exception.__init__(self, '%s %s failed (%s): %s' % \
+                (method, url, status, content))
+        self.method = method
+        self.url = url
+        self.status = status
+        self.content = content
+
+# A server error (5xx) or a connection error that persisted after retrying.
+class TransientError(GithubError):
+    pass
+
+def is_transient(r):
+    return r.status_code >= 500
+
 def result(r, expected_code):
     if r.status_code == expected_code:
         return json.loads(r.content)
@@ -61,36 +93,492 @@ def result(r, expected_code):
         print('[*] response content', r.content)
         return None
 
+# Stands in for the response to a POST that failed transiently but whose
+# effect turned out to be on GitHub already (see Github.post).
+class RecoveredResponse(object):
+    def __init__(self, item, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = json.dumps(item)
+
+# A response served from the cache after a 304. It carries the headers of the
+# fresh 304 response on top of the cached ones (e.g. X-Poll-Interval).
+class CachedResponse(object):
+    def __init__(self, entry, headers):
+        self.status_code = 200
+        self.content = entry['content']
+        self.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        self.headers.update(headers)
+
+# LRU cache of GET responses keyed by URL, holding the validators GitHub needs
+# for conditional requests. Entries evicted from memory survive in `cache_dir`
+# when one is given. 304 responses do not count against the rate limit.
+class ResponseCache(object):
+    kept_headers = ['ETag', 'Last-Modified', 'X-Poll-Interval', 'Link']
+
+    def __init__(self, size=128, cache_dir=None):
+        self.size = size
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def disk_path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.cache_dir, name)
+
+    def lookup(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is None and self.cache_dir is not None:
+                try:
+                    with open(self.disk_path(url)) as f:
+                        entry = json.load(f)
+                    entry['content'] = base64.b64decode(entry['content'])
+                except (IOError, OSError, ValueError, KeyError):
+                    entry = None
+            if entry is not None:
+                self.entries[url] = entry
+                self.evict()
+            return entry
+
+    def store(self, url, r):
+        headers = dict((k, r.headers[k]) for k in self.kept_headers \
+                       if k in r.headers)
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return
+        entry = {'headers': headers, 'content': r.content}
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = entry
+            self.evict()
+            if self.cache_dir is not None:
+                disk_entry = {'headers': headers,
+                        'content': base64.b64encode(r.content).decode('ascii')}
+                with open(self.disk_path(url), 'w') as f:
+                    json.dump(disk_entry, f)
+
+    def evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    # A write to `url` makes cached reads of the same resource, of its
+    # sub-resources, and of its parents stale.
+    def invalidate(self, url):
+        path = url.split('?')[0]
+        with self.lock:
+            for key in list(self.entries.keys()):
+                key_path = key.split('?')[0]
+                if key_path.startswith(path) or path.startswith(key_path):
+                    del self.entries[key]
+                    if self.cache_dir is not None:
+                        try: os.remove(self.disk_path(key))
+                        except OSError: pass
+
+# Request priorities. The evaluator's calls are HIGH; bulk jobs such as
+# download.py use LOW and leave a share of the budget to the evaluator.
+HIGH = 'high'
+LOW = 'low'
+
+def is_rate_limited(r):
+    if r.status_code == 429:
+        return True
+    return r.status_code == 403 and ('Retry-After' in r.headers or \
+            r.headers.get('X-RateLimit-Remaining') == '0')
+
+# Tracks the rate limit reported by GitHub and paces requests so that the
+# remaining budget is spent evenly until the reset time (a token bucket whose
+# rate is remaining / time-to-reset). LOW requests may not use the last
+# `reserve` fraction of the budget. Everything blocks while GitHub asks us to
+# back off (Retry-After, or an exhausted budget) until exactly that time.
+class RateLimiter(object):
+    def __init__(self, reserve=0.2, burst=10):
+        self.reserve = reserve
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0
+        self.tokens = burst
+        self.last = time.time()
+
+    def update(self, r):
+        with self.lock:
+            if 'X-RateLimit-Remaining' in r.headers:
+                self.limit = int(r.headers.get('X-RateLimit-Limit', 5000))
+                self.remaining = int(r.headers['X-RateLimit-Remaining'])
+                self.reset = int(r.headers.get('X-RateLimit-Reset', 0))
+            if is_rate_limited(r):
+                if 'Retry-After' in r.headers:
+                    until = time.time() + int(r.headers['Retry-After'])
+                elif self.reset:
+                    until = self.reset + 1
+                else:
+                    until = time.time() + 60
+                self.blocked_until = max(self.blocked_until, until)
+
+    def delay(self, priority, now):
+        wait = max(0, self.blocked_until - now)
+        if self.remaining is None or not self.reset or self.reset <= now:
+            return wait
+        reserved = self.limit * self.reserve if priority == LOW else 0
+        spendable = self.remaining - reserved
+        if spendable < 1:
+            return max(wait, self.reset + 1 - now)
+        rate = spendable / float(self.reset - now)
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * rate)
+        self.last = now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / rate)
+        return wait
+
+    # The requests left in the current window, or -1 while blocked. A limiter
+    # that has not seen a response yet is assumed to have its full budget.
+    def headroom(self, now):
+        with self.lock:
+            if self.blocked_until > now:
+                return -1
+            if self.remaining is None or not self.reset or self.reset <= now:
+                return self.limit or 5000
+            return self.remaining
+
+    def acquire(self, priority):
+        with self.lock:
+            wait = self.delay(priority, time.time())
+            self.tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+        if wait > 0:
+            if wait > 1:
+                print('[*] Rate limit: waiting %d seconds.' % wait)
+            time.sleep(wait)
+
+ISSUE_FIELDS = '''
+        number title body createdAt closedAt state
+        author { login }
+        labels(first: 20) { nodes { name } }
+        comments(first: $comments) { nodes { body author { login } } }
+'''
+
+ISSUES_QUERY = '''
+query($owner: String!, $repo: String!, $labels: [String!],
+      $states: [IssueState!], $cursor: String, $comments: Int!) {
+  repository(owner: $owner, name: $repo) {
+    issues(first: 100, after: $cursor, labels: $labels, states: $states,
+           orderBy: {field: CREATED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %s }
+    }
+  }
+}''' % ISSUE_FIELDS
+
+ISSUE_QUERY = '''
+query($owner: String!, $repo: String!, $number: Int!, $comments: Int!) {
+  repository(owner: $owner, name: $repo) {
+    issue(number: $number) { %s }
+  }
+}''' % ISSUE_FIELDS
+
+def login(author):
+    return author['login'] if author is not None else 'ghost'
+
+# Convert a GraphQL issue node to the dict shape of the REST API. The first
+# comments, which REST only returns from a separate call, are added under
+# `first_comments` in the shape of REST comments.
+def rest_issue(node):
+    return {'number': node['number'],
+            'title': node['title'],
+            'body': node['body'],
+            'created_at': node['createdAt'],
+            'closed_at': node['closedAt'],
+            'state': node['state'].lower(),
+            'user': {'login': login(node['author'])},
+            'labels': [{'name': l['name']} for l in node['labels']['nodes']],
+            'first_comments': [{'body': c['body'],
+                                'user': {'login': login(c['author'])}}
+                               for c in node['comments']['nodes']]}
+
+# Writes to an issue (its labels, state and comments) are sent with the same
+# credentials, so that they appear under one account.
+ISSUE_PATH = re.compile(r'/repos/([^/]+)/([^/]+)/issues/(\d+)')
+
+# Only these calls are spread over the token pool. Everything else, notably
+# /notifications and /user, belongs to the account of the first token.
+POOLED_PATH = re.compile(r'^(/repos/|/graphql$)')
+
+# One set of credentials, with its own session and rate limits.
+class Identity(object):
+    def __init__(self, name, session):
+        self.name = name
+        self.session = session
+        # GraphQL has its own budget, reported by the same headers.
+        self.limiters = {'core': RateLimiter(), 'graphql': RateLimiter()}
+        self.requests = 0
+
+    def usage(self):
+        limiter = self.limiters['core']
+        return {'name': self.name, 'requests': self.requests,
+                'remaining': limiter.remaining, 'limit': limiter.limit,
+                'reset': limiter.reset}
+
+def token_session(token):
+    session = requests.Session()
+    session.headers['Authorization'] = 'token %s' % token
+    return session
+
+# `token` is a token, a list of tokens, or a comma-separated string of them.
+# With several tokens, each request goes to the token with the most remaining
+# budget (see Github.pick()).
 class Github(object):
-    def __init__(self, username, token=None):
-        self.session = requests.Session()
+    def __init__(self, username, token=None, cache_size=128, cache_dir=None,
+                 priority=HIGH, max_rate_retries=3, max_retries=5, backoff=1.0,
+                 timeout=30):
+        self.cache = ResponseCache(cache_size, cache_dir)
+        self.priority = priority
+        self.max_rate_retries = max_rate_retries
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.identities = []
+        self.sticky = {}
+        self.lock = threading.Lock()
         if token is None:
             print('Github ID: %s' % username)
             password = getpass.getpass('Personal Access Token: ')
-            self.session.auth = (username, password)
-        else:
-            self.session.headers['Authorization'] = 'token %s' % token
+            session = requests.Session()
+            session.auth = (username, password)
+            self.identities.append(Identity(username, session))
+            return
+        if not isinstance(token, list):
+            token = [t.strip() for t in token.split(',') if t.strip()]
+        for t in token:
+            self.identities.append(Identity('...' + t[-4:], token_session(t)))
+
+    @property
+    def sessions(self):
+        return [identity.session for identity in self.identities]
+
+    # The identity with the most remaining budget for `resource`. Per-user
+    # calls go to the first (primary) identity, and writes to an issue stick to
+    # the identity that first wrote to it until release_issue().
+    def pick(self, method, url, resource):
+        path = requests.utils.urlparse(url).path
+        if not POOLED_PATH.match(path):
+            identity = self.identities[0]
+            with self.lock:
+                identity.requests += 1
+            return identity
+        key = None
+        match = ISSUE_PATH.search(path)
+        if method != 'GET' and match is not None:
+            key = match.groups()
+        with self.lock:
+            identity = self.sticky.get(key)
+            if identity is None:
+                now = time.time()
+                identity = max(self.identities, key=lambda i: \
+                        (i.limiters[resource].headroom(now), -i.requests))
+                if key is not None:
+                    self.sticky[key] = identity
+            identity.requests += 1
+            return identity
+
+    # Forget which identity writes to an issue that is finished.
+    def release_issue(self, owner, repo, number):
+        with self.lock:
+            self.sticky.pop((owner, repo, str(number)), None)
+
+    def usage(self):
+        return [identity.usage() for identity in self.identities]
+
+    def report_usage(self):
+        for u in self.usage():
+            if u['remaining'] is None:
+                print('[*] Token %s: %d requests' % (u['name'], u['requests']))
+            else:
+                print('[*] Token %s: %d requests, %d/%d left until %s' % \
+                        (u['name'], u['requests'], u['remaining'], \
+                         u['limit'], time.strftime('%H:%M:%S', \
+                         time.localtime(u['reset']))))
 
     @property
     def url(self):
         return 'https://api.github.com'
 
-    def post(self, query, data, expected_code=201):
-        return result(self.session.post(self.url + query, data), expected_code)
+    # `query` is either a path under the API root or an absolute URL taken
+    # from a Link header.
+    def conditional_get(self, query):
+        url = query if query.startswith('http') else self.url + query
+        entry = self.cache.lookup(url)
+        headers = {}
+        if entry is not None:
+            if 'ETag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if 'Last-Modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        r = self.request('GET', url, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            return CachedResponse(entry, r.headers)
+        if r.status_code == 200:
+            self.cache.store(url, r)
+        return r
+
+    # Exponential backoff with full jitter: a random wait of up to
+    # backoff * 2^(attempt-1) seconds, so that retries do not arrive together.
+    def retry_delay(self, attempt):
+        return random.uniform(0, self.backoff * (2 ** (attempt - 1)))
+
+    # Send a request, retrying server errors (5xx) and connection errors up to
+    # `max_retries` times and rate-limited responses up to `max_rate_retries`
+    # times. A TransientError is raised when the retries run out. Before
+    # retrying, `recover` (if given) is called to find out whether the failed
+    # attempt took effect anyway; a response it returns is used as is.
+    def request(self, method, url, resource='core', recover=None, **kwargs):
+        rate_retries = 0
+        attempt = 0
+        while True:
+            identity = self.pick(method, url, resource)
+            limiter = identity.limiters[resource]
+            limiter.acquire(self.priority)
+            try:
+                r = identity.session.request(method, url, \
+                        timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = TransientError(method, url, None, e)
+            else:
+                limiter.update(r)
+                if is_rate_limited(r) and rate_retries < self.max_rate_retries:
+                    rate_retries += 1
+                    print('[*] Rate limited on %s %s' % (method, url))
+                    continue
+                if not is_transient(r):
+                    return r
+                error = TransientError(method, url, r.status_code, r.content)
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            wait = self.retry_delay(attempt)
+            print('[*] %s; retrying in %.1f seconds.' % (error, wait))
+            time.sleep(wait)
+            if recover is not None:
+                recovered = recover()
+                if recovered is not None:
+                    return recovered
+
+    def invalidate(self, query):
+        self.cache.invalidate(self.url + query)
+
+    # POST is not idempotent: a retry after a lost response may create the
+    # same object twice. `exists`, if given, looks the object up on GitHub
+    # (e.g. by a marker in its body) and returns it or None; it is consulted
+    # before every retry so that a write that went through is not repeated.
+    def post(self, query, data, expected_code=201, exists=None):
+        def lookup():
+            item = exists()
+            if item is None:
+                return None
+            print('[*] POST %s already took effect.' % query)
+            return RecoveredResponse(item, expected_code)
+        recover = lookup if exists is not None else None
+        try:
+            r = self.request('POST', self.url + query, recover=recover, \
+                    data=data)
+        finally:
+            self.invalidate(query)
+        return result(r, expected_code)
 
     def get(self, query, expected_code=200):
-        return result(self.session.get(self.url + query), expected_code)
+        return result(self.conditional_get(query), expected_code)
 
     def put(self, query, data):
-        r = self.session.put(self.url + query, data = data)
+        try:
+            r = self.request('PUT', self.url + query, data=data)
+        finally:
+            self.invalidate(query)
         return r.status_code == 205
 
+    # GitHub answers 200 to issue edits and 205 to notification updates.
     def patch(self, query, data):
-        r = self.session.patch(self.url + query, data = data)
-        return r.status_code == 205
+        try:
+            r = self.request('PATCH', self.url + query, data=data)
+        finally:
+            self.invalidate(query)
+        return r.status_code in (200, 205)
+
+    # Yield the items of a paginated listing, following the `next` links.
+    # The next page is requested while the items of the current one are
+    # being consumed.
+    def iterate(self, query, expected_code=200):
+        prefetch = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = prefetch.submit(self.conditional_get, query)
+            while future is not None:
+                r = future.result()
+                page = result(r, expected_code)
+                if page is None:
+                    return
+                url = next_link(r)
+                future = None if url is None else \
+                    prefetch.submit(self.conditional_get, url)
+                for item in page:
+                    yield item
+        finally:
+            prefetch.shutdown(wait=False)
+
+    def graphql(self, query, variables):
+        r = self.request('POST', self.url + '/graphql', resource='graphql', \
+                data=json.dumps({'query': query, 'variables': variables}))
+        response = result(r, 200)
+        if response is None:
+            return None
+        if response.get('errors'):
+            print('[*] GraphQL errors:', response['errors'])
+            return None
+        return response['data']
+
+    # Yield the issues of a repository with their labels, authors and first
+    # `comments` comments, 100 issues per request. As in iterate(), the next
+    # page is requested while the current one is being consumed.
+    def iterate_issues(self, owner, repo, labels=None, states=('OPEN',),
+                       comments=10):
+        variables = {'owner': owner, 'repo': repo, 'labels': labels,
+                     'states': list(states), 'cursor': None,
+                     'comments': comments}
+        prefetch = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = prefetch.submit(self.graphql, ISSUES_QUERY, \
+                    dict(variables))
+            while future is not None:
+                data = future.result()
+                if data is None or data['repository'] is None:
+                    return
+                issues = data['repository']['issues']
+                future = None
+                if issues['pageInfo']['hasNextPage']:
+                    variables['cursor'] = issues['pageInfo']['endCursor']
+                    future = prefetch.submit(self.graphql, ISSUES_QUERY, \
+                            dict(variables))
+                for node in issues['nodes']:
+                    yield rest_issue(node)
+        finally:
+            prefetch.shutdown(wait=False)
+
+    def get_issue_with_comments(self, owner, repo, number, comments=10):
+        data = self.graphql(ISSUE_QUERY, {'owner': owner, 'repo': repo,
+                                          'number': int(number),
+                                          'comments': comments})
+        if data is None or data['repository'] is None or \
+                data['repository']['issue'] is None:
+            return None
+        return rest_issue(data['repository']['issue'])
 
     def poll(self, query):
-        r = self.session.get(self.url + query)
-        poll_interval = int(r.headers['X-Poll-Interval'])
+        r = self.conditional_get(query)
+        poll_interval = int(r.headers.get('X-Poll-Interval', 60))
         response = result(r, 200)
+        url = next_link(r)
+        if response is not None and url is not None:
+            response.extend(self.iterate(url))
         return response, poll_interval
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+import io
+import os
+import re
+import copy
+import json
+import time
+import hashlib
+import tarfile
+import tempfile
+import threading
+from cmd import run_command
+
+# Service images are tagged by the git tree of the service directory with the
+# flag file left out, so rebuilding an unchanged commit (e.g. for another
+# attacker's issue) is skipped. The per-verification flag is copied into the
+# container after it is created and before it starts, instead of being baked
+# into the image, with the owner and mode the image gave the flag file.
+
+IMAGE_REPO = 'gitctf-service'
+INDEX_FILE = '.image_cache.json'
+
+# Number of images kept; 0 disables the cache. Only the evaluator enables it
+# (`image_cache_size` in its config), so players' tools always build afresh.
+cache_size = 0
+
+def configure(size):
+    global cache_size
+    cache_size = size
+
+index_lock = threading.Lock()
+build_locks = {}
+flag_members = {} # image -> tar header of its flag file
+
+def get_tree_key(service_dir):
+    output, err, r = run_command('git -C %s ls-tree -r HEAD' % service_dir, \
+            os.getcwd())
+    if r != 0:
+        print('[*] Failed to read the tree of %s' % service_dir)
+        print(err)
+        return None
+    entries = [l for l in output.splitlines() if l and l.split('\t')[-1] != 'flag']
+    return hashlib.sha1('\n'.join(entries).encode('utf-8')).hexdigest()
+
+# The location of the flag inside the image, from "COPY flag <dst>". Only an
+# absolute file path is supported; a directory (or a path relative to WORKDIR)
+# leaves the service to the uncached build.
+def get_flag_dst(service_dir):
+    dockerfile = os.path.join(service_dir, 'Dockerfile')
+    if not os.path.isfile(dockerfile):
+        return None
+    with open(dockerfile) as f:
+        for line in f:
+            m = re.match(r'\s*(?:COPY|ADD)\s+(?:\./)?flag\s+(\S+)\s*$', line, re.I)
+            if m:
+                dst = m.group(1)
+                if not dst.startswith('/') or dst.endswith('/'):
+                    return None
+                return dst
+    return None
+
+def image_name(key):
+    return '%s:%s' % (IMAGE_REPO, key)
+
+def image_exists(image):
+    _, _, r = run_command('docker image inspect %s' % image, os.getcwd())
+    return r == 0
+
+# Maps image names to when they were last used. Older indexes were keyed by
+# the tree key alone.
+def load_index():
+    try:
+        with open(INDEX_FILE) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return dict((k if ':' in k else image_name(k), v) \
+                for k, v in index.items())
+
+def save_index(index):
+    with open(INDEX_FILE, 'w') as f:
+        json.dump(index, f, indent=4)
+
+# Record the use of `image` and drop the least recently used images beyond
+# `size`. Images still used by a running container cannot be removed and stay
+# in the index. Images built without the cache (tagged by service and branch)
+# are recorded too, so that the same bound covers them.
+def touch(image, size):
+    if ':' not in image:
+        image += ':latest'
+    with index_lock:
+        index = load_index()
+        index[image] = time.time()
+        for old in sorted(index, key=lambda k: index[k])[:max(0, len(index) - size)]:
+            if old == image:
+                continue
+            _, _, r = run_command('docker rmi %s' % old, os.getcwd())
+            if r == 0 or not image_exists(old):
+                print('[*] Evicted image %s' % old)
+                del index[old]
+        save_index(index)
+
+# Return the image for `key`, building it from `service_dir` on a miss, and
+# whether it was a cache hit.
+def get_image(service_dir, key, size):
+    with index_lock:
+        lock = build_locks.setdefault(key, threading.Lock())
+    image = image_name(key)
+    with lock:
+        hit = image_exists(image)
+        if not hit:
+            _, err, r = run_command('docker build -t %s .' % image, service_dir)
+            if r != 0:
+                print('[*] Failed to build %s' % image)
+                print(err)
+                return None, False
+    touch(image, size)
+    return image, hit
+
+# On a private network the service is not published on the host at all.
+def create_service(image, container_name, service_port, host_port, network=None):
+    cmdline = 'docker create --rm --name %s ' % container_name
+    if network is None:
+        cmdline += '-p %d:%d ' % (host_port, service_port)
+    else:
+        cmdline += '--network %s ' % network
+    cmdline += image
+    return run_command(cmdline, os.getcwd())
+
+# The tar header of the flag file in a created container, or None if it is not
+# a regular file.
+def read_flag_member(container_name, flag_dst):
+    fd, path = tempfile.mkstemp(prefix='gitctf_flag_', suffix='.tar')
+    os.close(fd)
+    try:
+        _, err, r = run_command('docker cp %s:%s -' % \
+                (container_name, flag_dst), os.getcwd(), quiet=True, tee=path)
+        if r != 0:
+            print('[*] Failed to read %s from %s' % (flag_dst, container_name))
+            print(err)
+            return None
+        with tarfile.open(path) as tar:
+            member = tar.next()
+    except tarfile.TarError:
+        return None
+    finally:
+        os.remove(path)
+    return member if member is not None and member.isfile() else None
+
+# Replace the flag of a created container by `flag_str`, keeping the owner and
+# mode of the file in `image` (root:<bin_name> 0440 in the template), so that
+# the flag is exactly as readable as in a service built from scratch. Returns
+# None if the flag in the image is not a regular file.
+def inject_flag(image, container_name, flag_dst, flag_str):
+    member = flag_members.get(image)
+    if member is None:
+        member = read_flag_member(container_name, flag_dst)
+        if member is None:
+            return None
+        flag_members[image] = member
+    data = flag_str.encode('utf-8')
+    info = copy.copy(member)
+    info.name = os.path.basename(flag_dst)
+    info.size = len(data)
+    info.mtime = time.time()
+    fd, path = tempfile.mkstemp(prefix='gitctf_flag_', suffix='.tar')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with tarfile.open(fileobj=f, mode='w') as tar:
+                tar.addfile(info, io.BytesIO(data))
+        # -a keeps the uid and gid of the tar header.
+        return run_command('docker cp -a - %s:%s' % (container_name, \
+                os.path.dirname(flag_dst)), os.getcwd(), stdin=path)
+    finally:
+        os.remove(path)
+
+def start_container(container_name):
+    return run_command('docker start %s' % container_name, os.getcwd())
@@ -23,66 +23,145 @@
 
 from __future__ import print_function
 import json
-import sys
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from utils import iso8601_to_timestamp
+from github import GithubError
 from datetime import datetime, timedelta
 
+# Labels known to exist, per (repo_owner, repo_name). Filled by
+# bootstrap_labels() so that create_label() does not POST them again.
+known_labels = {}
+labels_lock = threading.Lock()
+
+# Runs the independent calls of transition_issue(), shared by all issues.
+transition_pool = ThreadPoolExecutor(max_workers=16)
+
 def create_label(repo_owner, repo_name, label_name, \
         color, desc, github):
+    with labels_lock:
+        if label_name in known_labels.get((repo_owner, repo_name), ()):
+            return
 
     query = '/repos/%s/%s/labels' % (repo_owner, repo_name)
     issue = {'name': label_name, 'description': desc, 'color': color}
     # Add the label to the repository
     if github.post(query, json.dumps(issue)) is None:
         print('[*] Label already exists in %s' % label_name)
+    with labels_lock:
+        known_labels.setdefault((repo_owner, repo_name), set()).add(label_name)
+
+def list_labels(repo_owner, repo_name, github):
+    query = '/repos/%s/%s/labels?per_page=100' % (repo_owner, repo_name)
+    return set(label['name'] for label in github.iterate(query))
+
+# List the labels of a repository once and create the missing ones among
+# `labels`, a dict of name -> (color, description).
+def bootstrap_labels(repo_owner, repo_name, labels, github):
+    existing = list_labels(repo_owner, repo_name, github)
+    with labels_lock:
+        known_labels[(repo_owner, repo_name)] = existing
+    for name in labels:
+        if name not in existing:
+            color, desc = labels[name]
+            create_label(repo_owner, repo_name, name, color, desc, github)
 
-def update_label(repo_owner, repo_name, issue_no, github, label):
+def update_label(repo_owner, repo_name, issue_no, github, label, snapshot=None):
     query = '/repos/%s/%s/issues/%s' % (repo_owner, repo_name, issue_no)
     labels = [label]
     issue = {'labels': labels}
     r = github.patch(query, json.dumps(issue))
-    if r is None:
-        print('[*] Could not create comment in "%s/%s"' % (repo_name, issue_no))
+    if snapshot is not None:
+        snapshot.invalidate()
+    if not r:
+        print('[*] Could not update label in "%s/%s"' % (repo_name, issue_no))
     else:
         print('[*] Successfully updated label')
 
 
+# Look for an issue with the given title and body among the latest ones.
+def find_issue(repo_owner, repo_name, title, body, github):
+    query = '/repos/%s/%s/issues?state=all&sort=created&direction=desc' \
+            '&per_page=30' % (repo_owner, repo_name)
+    for issue in github.get(query) or []:
+        if issue['title'] == title and issue['body'] == body:
+            return issue
+    return None
+
 def make_github_issue(repo_owner, repo_name, title, body, github):
     '''Create an issue on github.com using the given parameters.'''
     query = '/repos/%s/%s/issues' % (repo_owner, repo_name)
     issue = {'title': title, 'body': body}
-    r = github.post(query, json.dumps(issue), 201)
+    def exists():
+        return find_issue(repo_owner, repo_name, title, body, github)
+    r = github.post(query, json.dumps(issue), 201, exists)
     if r is None:
         print('[*] Could not create issue "%s"' % title)
-        print('[*] Response:', r)
-        sys.exit(-1)
+        raise GithubError('POST', query, None, 'Could not create issue')
     else:
         print('[*] Successfully created issue "%s"' % title)
 
         return r['number'], r['url']
 
-def get_github_issue(repo_owner, repo_name, issue_no, github):
-    '''Retrieve an issue on github.com using the given parameters.'''
+# The fields of one issue, fetched with a single GET and shared by everything
+# that processes the issue. Functions here that change the issue on GitHub
+# mark the snapshot stale when it is passed to them.
+class IssueSnapshot(object):
+    def __init__(self, repo_owner, repo_name, issue_no, r):
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.issue_no = issue_no
+        self.update(r)
+
+    def update(self, r):
+        self.title = r['title']
+        self.submitter = r['user']['login']
+        self.created_at = r['created_at']
+        self.create_timestamp = int(iso8601_to_timestamp(self.created_at))
+        self.content = r['body']
+        self.closed = r['closed_at'] is not None
+        self.stale = False
+
+    def invalidate(self):
+        self.stale = True
+
+    def refresh(self, github):
+        if self.stale:
+            query = '/repos/%s/%s/issues/%s' % \
+                    (self.repo_owner, self.repo_name, self.issue_no)
+            r = github.get(query)
+            if r is not None:
+                self.update(r)
+        return self
+
+    def as_tuple(self):
+        return (self.title, self.submitter, self.create_timestamp, self.content)
+
+def fetch_issue(repo_owner, repo_name, issue_no, github):
+    '''Retrieve an issue on github.com as an IssueSnapshot.'''
     query = '/repos/%s/%s/issues/%s' % (repo_owner, repo_name, issue_no)
     r = github.get(query)
     if r is None:
         print('Could not get Issue from %s' % query)
         print('Response:', r)
-        sys.exit(-1)
-    else:
-        print('[*] Successfully obtained issue #%s' % issue_no)
-        print('[*] title:', r['title'])
-        print('[*] creater:', r['user']['login'])
-        dt = datetime.strptime(r['created_at'],'%Y-%m-%dT%H:%M:%SZ')
-        # XXX do not assume it is in Korea, just use the current tz.
-        open_time = dt + timedelta(hours = 9) # Change to the Korea time
-        print('[*] open time:', open_time)
-        title = r['title']
-        submitter = r['user']['login']
-        create_time = r['created_at']
-        content = r['body']
-        create_timestamp = int(iso8601_to_timestamp(create_time))
-        return (title, submitter, create_timestamp, content)
+        return None
+    print('[*] Successfully obtained issue #%s' % issue_no)
+    print('[*] title:', r['title'])
+    print('[*] creater:', r['user']['login'])
+    dt = datetime.strptime(r['created_at'],'%Y-%m-%dT%H:%M:%SZ')
+    # XXX do not assume it is in Korea, just use the current tz.
+    open_time = dt + timedelta(hours = 9) # Change to the Korea time
+    print('[*] open time:', open_time)
+    return IssueSnapshot(repo_owner, repo_name, issue_no, r)
+
+def get_github_issue(repo_owner, repo_name, issue_no, github):
+    '''Retrieve an issue on github.com using the given parameters.'''
+    snapshot = fetch_issue(repo_owner, repo_name, issue_no, github)
+    if snapshot is None:
+        raise GithubError('GET', '/repos/%s/%s/issues/%s' % \
+                (repo_owner, repo_name, issue_no), None, 'Could not get issue')
+    return snapshot.as_tuple()
 
 def submit_issue(title, encrypted_exploit, target_team, config, github):
     # Retrieve information from config
@@ -95,7 +174,9 @@ def submit_issue(title, encrypted_exploit, target_team, config, github):
 
     return make_github_issue(repo_owner, repo_name, title, content, github)
 
-def is_closed(repo_owner, repo_name, issue_no, github):
+def is_closed(repo_owner, repo_name, issue_no, github, snapshot=None):
+    if snapshot is not None:
+        return snapshot.refresh(github).closed
     query = '/repos/%s/%s/issues/%s' % (repo_owner, repo_name, issue_no)
     r = github.get(query)
     if r is None:
@@ -108,29 +189,90 @@ def is_closed(repo_owner, repo_name, issue_no, github):
         else:
             return True
 
-def create_comment(repo_owner, repo_name, issue_no, comment, github):
+def comment_marker(repo_owner, repo_name, issue_no, comment):
+    key = '%s/%s#%s:%s' % (repo_owner, repo_name, issue_no, comment)
+    return '<!-- gitctf:%s -->' % \
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def find_comment(query, marker, github):
+    for comment in github.iterate(query + '?per_page=100'):
+        if marker in comment['body']:
+            return comment
+    return None
+
+def create_comment(repo_owner, repo_name, issue_no, comment, github, \
+        snapshot=None):
     query = '/repos/%s/%s/issues/%s/comments' % \
             (repo_owner, repo_name, issue_no)
 
-    issue = {'body': comment}
-    r = github.post(query, json.dumps(issue), 201)
+    # A hidden marker identifies the comment, so that a retried POST does not
+    # post it twice.
+    marker = comment_marker(repo_owner, repo_name, issue_no, comment)
+    issue = {'body': comment + '\n\n' + marker}
+    def exists():
+        return find_comment(query, marker, github)
+    r = github.post(query, json.dumps(issue), 201, exists)
+    if snapshot is not None:
+        snapshot.invalidate()
     if r is None:
         print('[*] Could not create comment in "%s/%s"' % (repo_name, issue_no))
         print(r)
     else:
         print('[*] Successfully created comment')
 
-def close_issue(repo_owner, repo_name, issue_no, github):
+def close_issue(repo_owner, repo_name, issue_no, github, snapshot=None):
     query = '/repos/%s/%s/issues/%s' % \
             (repo_owner, repo_name, issue_no)
 
     issue = {'state': 'closed'}
     r = github.patch(query, json.dumps(issue))
-    if r is None:
+    if snapshot is not None:
+        snapshot.invalidate()
+    if not r:
         print('[*] Could not close "%s/%s"' % (repo_name, issue_no))
     else:
         print('[*] Successfully closed')
 
+def edit_issue(repo_owner, repo_name, issue_no, edit, github, snapshot=None):
+    query = '/repos/%s/%s/issues/%s' % (repo_owner, repo_name, issue_no)
+    r = github.patch(query, json.dumps(edit))
+    if snapshot is not None:
+        snapshot.invalidate()
+    if not r:
+        print('[*] Could not update "%s/%s"' % (repo_name, issue_no))
+    else:
+        print('[*] Successfully updated %s' % ', '.join(sorted(edit)))
+    return r
+
+# Bring an issue to a target state with as few calls as possible: `labels`
+# (replacing the current ones) and `state` ('open' or 'closed') go in a single
+# PATCH, which is sent concurrently with the comment. The `after` calls (e.g.
+# marking the notification read) only run once the PATCH has succeeded.
+# Returns whether it did, and raises the first GithubError once all calls are
+# done.
+def transition_issue(repo_owner, repo_name, issue_no, github, labels=None,
+                     state=None, comment=None, snapshot=None, after=()):
+    edit = {}
+    if labels is not None:
+        edit['labels'] = labels
+    if state is not None:
+        edit['state'] = state
+    def apply_edit():
+        if edit and not edit_issue(repo_owner, repo_name, issue_no, edit, \
+                github, snapshot):
+            return False
+        for call in after:
+            call()
+        return True
+    calls = [apply_edit]
+    if comment is not None:
+        calls.append(lambda: create_comment(repo_owner, repo_name, issue_no, \
+                comment, github, snapshot))
+    futures = [transition_pool.submit(call) for call in calls]
+    wait(futures)
+    for future in futures:
+        future.result()
+    return futures[0].result()
 
 # TODO : maybe we can add main function so this can be used like
 # "python issue.py SUBMIT ..." or "python issue.py FETCH ..."
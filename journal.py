@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+import json
+import time
+import sqlite3
+import threading
+
+# Job states, in order. A job is `seen` once its notification (or webhook) has
+# been recorded, `decrypted` once its exploit is on disk, `verified` once the
+# exploit worked and the issue was labeled, and `done` once nothing is left to
+# do for it (failed, defended or closed; the notification is marked read).
+SEEN = 'seen'
+DECRYPTED = 'decrypted'
+VERIFIED = 'verified'
+DONE = 'done'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    repo TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    thread TEXT,
+    gen_time INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated INTEGER NOT NULL,
+    PRIMARY KEY (repo, num)
+);
+CREATE TABLE IF NOT EXISTS cursor (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+class Job(object):
+    def __init__(self, repo, num, thread, gen_time, state, data):
+        self.repo = repo
+        self.num = num
+        self.thread = thread
+        self.gen_time = gen_time
+        self.state = state
+        self.data = data
+
+# The evaluator's record of outstanding work, kept in SQLite so that it
+# survives a restart: the `since` cursor of the notification poll, and the
+# state of every issue seen so far along with what each completed step
+# produced (see evaluate.process_issue()).
+class Journal(object):
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def get_cursor(self, name):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM cursor WHERE name = ?', \
+                    (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_cursor(self, name, value):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO cursor VALUES (?, ?)', \
+                    (name, value))
+
+    def get(self, repo, num):
+        with self.lock:
+            row = self.db.execute('SELECT repo, num, thread, gen_time, state, ' \
+                    'data FROM jobs WHERE repo = ? AND num = ?', \
+                    (repo, num)).fetchone()
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]))
+
+    # Record an issue to process and return its job. A known job keeps its
+    # state and generation time (the time of the attack), but takes the
+    # notification thread if it did not have one. A finished job starts over
+    # when the issue has changed since.
+    def record(self, repo, num, thread, gen_time):
+        num = int(num)
+        gen_time = int(gen_time)
+        with self.lock, self.db:
+            row = self.db.execute('SELECT thread, gen_time, state FROM jobs ' \
+                    'WHERE repo = ? AND num = ?', (repo, num)).fetchone()
+            if row is None or (row[2] == DONE and gen_time > row[1]):
+                self.db.execute('INSERT OR REPLACE INTO jobs VALUES ' \
+                        '(?, ?, ?, ?, ?, ?, ?)', (repo, num, thread, gen_time, \
+                        SEEN, '{}', int(time.time())))
+            elif thread and thread != row[0]:
+                self.db.execute('UPDATE jobs SET thread = ? WHERE repo = ? ' \
+                        'AND num = ?', (thread, repo, num))
+        return self.get(repo, num)
+
+    # Move a job to `state`, merging `data` into what earlier steps stored.
+    def advance(self, job, state, **data):
+        job.state = state
+        job.data.update(data)
+        with self.lock, self.db:
+            self.db.execute('UPDATE jobs SET state = ?, data = ?, updated = ? ' \
+                    'WHERE repo = ? AND num = ?', (state, json.dumps(job.data), \
+                    int(time.time()), job.repo, job.num))
+
+    # The jobs that are not done, oldest first.
+    def outstanding(self):
+        with self.lock:
+            rows = self.db.execute('SELECT repo, num, thread, gen_time FROM ' \
+                    'jobs WHERE state != ? ORDER BY gen_time', \
+                    (DONE,)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
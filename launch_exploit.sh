@@ -21,8 +21,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-if [ "$#" -ne 4 ]; then
-    echo "Usage: $0 [exploit name] [ip] [port] [timeout]"
+# The image is tagged with the exploit name unless given with -i.
+IMAGE=
+if [ "$1" = "-i" ]; then
+    IMAGE=$2
+    shift 2
+fi
+
+if [ "$#" -lt 4 ] || [ "$#" -gt 5 ]; then
+    echo "Usage: $0 (-i [image]) [exploit name] [ip] [port] [timeout] ([network])"
     exit 1
 fi
 
@@ -30,11 +37,13 @@ EXPLOITNAME=$1
 SERVICE_IP=$2
 SERVICE_PORT=$3
 TIMEOUT=$4
+NETWORK=${5:-host}
+IMAGE=${IMAGE:-$EXPLOITNAME}
 
 
 
-docker build -t $EXPLOITNAME .
+docker build -t $IMAGE .
 
-docker run -t --rm --net="host" --name $EXPLOITNAME \
-    $EXPLOITNAME timeout $TIMEOUT \
+docker run -t --rm --net="$NETWORK" --name $EXPLOITNAME \
+    $IMAGE timeout $TIMEOUT \
     "/bin/exploit" $SERVICE_IP $SERVICE_PORT
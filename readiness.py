@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+import json
+import time
+import socket
+import threading
+from cmd import run_command
+
+# Waiting for a freshly started service container. By default the service is
+# ready once its port accepts a TCP connection; a team may declare its own probe
+# command in config (`ready_probe`, with {ip} and {port} placeholders).
+#
+# The container is probed on its own address. Its published host port is no
+# use: docker's userland proxy accepts connections there as soon as the
+# container starts, whether or not the service listens yet.
+
+STATS_FILE = '.readiness.json'
+FALLBACK_DELAY = 2 # Seconds to wait when the container cannot be probed
+
+stats_lock = threading.Lock()
+
+def tcp_probe(host, port):
+    try:
+        sock = socket.create_connection((host, port), timeout=1)
+        sock.close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+def command_probe(command, host, port):
+    _, _, r = run_command(command.format(ip=host, port=port), None)
+    return r == 0
+
+# Poll with exponential backoff until the service is ready or `deadline`
+# seconds have passed. Return the time it took, or None on timeout.
+def wait_until_ready(host, port, deadline=30, probe=None, delay=0.05,
+                     max_delay=1.0):
+    start = time.time()
+    while True:
+        if probe is None:
+            ready = tcp_probe(host, port)
+        else:
+            ready = command_probe(probe, host, port)
+        elapsed = time.time() - start
+        if ready:
+            return elapsed
+        if elapsed + delay > deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def container_address(container_name):
+    output, _, r = run_command("docker inspect -f " \
+            "'{{range .NetworkSettings.Networks}}{{.IPAddress}} {{end}}' %s" \
+            % container_name, None)
+    addresses = output.split()
+    return addresses[0] if r == 0 and addresses else None
+
+# wait_until_ready() on the address of a container, for the port its service
+# listens on inside the container. Without an address, just wait a little.
+def wait_for_container(container_name, port, deadline=30, probe=None):
+    host = container_address(container_name)
+    if host is None:
+        print('[*] No address for %s; waiting %d seconds' % \
+                (container_name, FALLBACK_DELAY))
+        time.sleep(FALLBACK_DELAY)
+        return None
+    return wait_until_ready(host, port, deadline, probe)
+
+def get_probe(config, repo_name):
+    for team in config.get('teams', {}).values():
+        if team.get('repo_name') == repo_name:
+            return team.get('ready_probe')
+    return None
+
+def record_ready_time(image, elapsed):
+    with stats_lock:
+        try:
+            with open(STATS_FILE) as f:
+                stats = json.load(f)
+        except (IOError, OSError, ValueError):
+            stats = {}
+        s = stats.setdefault(image, {'count': 0, 'total': 0.0, 'max': 0.0})
+        s['count'] += 1
+        s['total'] += elapsed
+        s['max'] = max(s['max'], elapsed)
+        s['last'] = elapsed
+        with open(STATS_FILE, 'w') as f:
+            json.dump(stats, f, indent=4)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import print_function
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cmd import run_command
+from utils import rmdir
+from git import clone, get_ancestry_path
+from verify_exploit import verify_exploit
+
+# Extra working copies used by batch_search(), one per concurrent run.
+REVERIFY_DIR = '.reverify'
+
+# Re-verification of an already decrypted exploit against the commits a
+# defender pushed after the last attacked commit. The ancestry path is computed
+# once and every commit is checked out in the same working copy, or in a few
+# worktrees of it when commits are verified in batches.
+
+# Walk every commit in order. Each commit the exploit still works against is
+# reported, which is needed when every intermediate result is scored.
+def linear_search(commits, works):
+    vulnerable = []
+    for commit in commits:
+        if not works(commit):
+            return vulnerable, commit
+        vulnerable.append(commit)
+    return vulnerable, None
+
+# Find the first defending commit with O(log n) runs. This assumes that once a
+# commit defeats the exploit, every later commit does too. Only the last commit
+# the exploit was seen working against is reported.
+def bisect_search(commits, works):
+    lo, hi = 0, len(commits)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if works(commits[mid]):
+            lo = mid + 1
+        else:
+            hi = mid
+    vulnerable = [commits[lo - 1]] if lo > 0 else []
+    defending = commits[lo] if lo < len(commits) else None
+    return vulnerable, defending
+
+# Same result as linear_search(), but `size` commits are verified at once, each
+# in its own working copy (`works` takes the index of the copy). Up to size - 1
+# runs past the defending commit are wasted.
+def batch_search(commits, works, size):
+    vulnerable = []
+    with ThreadPoolExecutor(max_workers=size) as pool:
+        for i in range(0, len(commits), size):
+            batch = commits[i:i + size]
+            results = list(pool.map(works, batch, range(len(batch))))
+            for commit, result in zip(batch, results):
+                if not result:
+                    return vulnerable, commit
+                vulnerable.append(commit)
+    return vulnerable, None
+
+strategies = {'linear': linear_search, 'bisect': bisect_search,
+              'batch': batch_search}
+
+# Working copies sharing the objects of `repo_name` through git worktree. They
+# keep its directory name, which names the containers and selects the probe.
+def add_worktrees(repo_name, count):
+    copies = [repo_name]
+    for i in range(1, count):
+        copy = os.path.join(REVERIFY_DIR, str(i), repo_name)
+        rmdir(copy)
+        _, err, r = run_command('git -C %s worktree add --detach %s' % \
+                (repo_name, os.path.abspath(copy)), os.getcwd())
+        if r != 0:
+            print('[*] Failed to add a worktree for %s' % repo_name)
+            print(err)
+            break
+        copies.append(copy)
+    return copies
+
+def reverify(exploit_dir, repo_owner, repo_name, branch, last_commit, config):
+    strategy = config.get('unintended_search', 'linear')
+    if strategy not in strategies:
+        print('[*] Unknown search strategy %s, using linear.' % strategy)
+        strategy = 'linear'
+    timeout = config["exploit_timeout"]["exercise_phase"]
+
+    clone(repo_owner, repo_name, cached=True)
+    commits = get_ancestry_path(repo_name, branch, last_commit)
+    print('[*] %d commit(s) to verify against (%s).' % (len(commits), strategy))
+
+    copies = [repo_name]
+    if strategy == 'batch':
+        size = min(config.get('unintended_batch_size', 4), len(commits))
+        copies = add_worktrees(repo_name, max(size, 1))
+
+    def works(commit, copy=0):
+        result, _ = verify_exploit(exploit_dir, copies[copy], commit, \
+                timeout, config)
+        return result
+
+    if strategy == 'batch':
+        vulnerable, defending = batch_search(commits, works, len(copies))
+    else:
+        vulnerable, defending = strategies[strategy](commits, works)
+    for copy in copies[1:]:
+        rmdir(copy)
+    rmdir(repo_name)
+    return vulnerable, defending
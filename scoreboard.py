@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+import os
+import csv
+import json
+import binascii
+import time
+import random
+import threading
+from cmd import run_command
+from tracing import span
+from utils import rmfile
+
+msg_file = 'msg' # Temporarily store commit message
+
+def format_row(stamp, info, pts):
+    return '%s,%s,%s,%s,%s,%d\n' % (stamp, info['attacker'], info['defender'], \
+            info['branch'], info['bugkind'], pts)
+
+def describe(info, pts):
+    if pts == 0: # Protocol to indicate successfull defense
+        return '%s defended `%s` %s with %s' % (info['defender'], \
+                info['branch'], info['attacker'], info['bugkind'])
+    else:
+        return '%s attacked `%s` %s of %s' % (info['attacker'], \
+                info['branch'], info['bugkind'], info['defender'])
+
+def write_message(events, scoreboard_dir):
+    with open(os.path.join(scoreboard_dir, msg_file), 'w') as f:
+        if len(events) == 1:
+            info, pts = events[0]
+            f.write('[Score] %s +%d\n\n' % (info['attacker'], pts))
+        else:
+            f.write('[Score] %d updates\n\n' % len(events))
+        for info, pts in events:
+            f.write(describe(info, pts) + '\n')
+
+# Maps (attacker, defender, branch) to the commits attacked so far, in the order
+# they appear in score.csv. The index is kept in sync with the file by parsing
+# only the bytes appended since the last `offset`, which is checkpointed to disk
+# so that a restarted evaluator does not have to parse the whole history.
+class AttackIndex(object):
+    def __init__(self, score_path, checkpoint=None):
+        self.score_path = score_path
+        self.checkpoint = checkpoint
+        self.attacks = {}
+        self.offset = 0
+        self.tail = b''
+        self.load()
+        self.refresh()
+
+    def clear(self):
+        self.attacks = {}
+        self.offset = 0
+        self.tail = b''
+
+    def add(self, row):
+        if len(row) < 6 or len(row[4]) != 40:
+            return
+        try:
+            stamp = int(row[0])
+        except ValueError:
+            return
+        key = (row[1], row[2], row[3])
+        self.attacks.setdefault(key, []).append((stamp, row[4]))
+
+    def contains(self, attacker, defender, branch, stamp, commit):
+        return (stamp, commit) in self.attacks.get((attacker, defender, \
+                branch), [])
+
+    # Return the last commit attacked at or after `timestamp`.
+    def find(self, attacker, defender, branch, timestamp):
+        for stamp, commit in reversed(self.attacks.get((attacker, defender, \
+                branch), [])):
+            if stamp >= timestamp:
+                return commit
+        return None
+
+    # The bytes right before `offset` must not have changed; otherwise the file
+    # was rewritten (e.g. by a rebase) and we parse it again from the start.
+    def is_valid(self, f):
+        size = os.fstat(f.fileno()).st_size
+        if size < self.offset:
+            return False
+        f.seek(self.offset - len(self.tail))
+        return f.read(len(self.tail)) == self.tail
+
+    def refresh(self):
+        if not os.path.isfile(self.score_path):
+            self.clear()
+            return
+        with open(self.score_path, 'rb') as f:
+            if not self.is_valid(f):
+                print('[*] score.csv was rewritten. Rebuilding the index.')
+                self.clear()
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1 # Leave a partial last line for later
+        if end == 0:
+            return
+        for row in csv.reader(data[:end].decode('utf-8').splitlines()):
+            self.add(row)
+        self.offset += end
+        self.tail = data[max(0, end - 64):end]
+
+    def load(self):
+        if self.checkpoint is None or not os.path.isfile(self.checkpoint):
+            return
+        try:
+            with open(self.checkpoint) as f:
+                state = json.load(f)
+            self.offset = state['offset']
+            self.tail = binascii.unhexlify(state['tail'])
+            for attacker, defender, branch, attacks in state['attacks']:
+                self.attacks[(attacker, defender, branch)] = \
+                    [(stamp, commit) for stamp, commit in attacks]
+        except Exception as e:
+            print('[*] Ignoring broken index checkpoint %s' % self.checkpoint)
+            print(repr(e))
+            self.clear()
+
+    def save(self):
+        if self.checkpoint is None:
+            return
+        attacks = [list(key) + [value] for key, value in self.attacks.items()]
+        tail = binascii.hexlify(self.tail).decode('ascii')
+        state = {'offset': self.offset, 'tail': tail, 'attacks': attacks}
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp, self.checkpoint)
+
+# Queues score rows and pushes them to the scoreboard repository as a single
+# commit once `max_rows` rows are pending or the oldest one has waited for
+# `max_delay` seconds. Rows are appended to score.csv right away, so local
+# readers holding `lock` always see them. While a push is backing off, `lock` is
+# released and new rows are held in `deferred` until the rebase is over.
+class ScoreboardWriter(object):
+    def __init__(self, path, max_rows=16, max_delay=10, max_retries=5):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.pending = []   # (row, info, pts) not committed yet
+        self.unpushed = []  # (row, info, pts) committed but not pushed yet
+        self.deferred = []  # (row, info, pts) appended during a push backoff
+        self.oldest = None
+        self.closed = False
+        self.pushing = False
+        self.index = AttackIndex(self.score_path, path.rstrip('/') + '.idx')
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def score_path(self):
+        return os.path.join(self.path, 'score.csv')
+
+    def append(self, stamp, info, pts):
+        with self.lock:
+            row = format_row(stamp, info, pts)
+            if self.pushing:
+                self.deferred.append((row, dict(info), pts))
+                return
+            self._add(row, info, pts)
+            if len(self.pending) >= self.max_rows:
+                self._flush()
+            else:
+                self.cond.notify()
+
+    def flush(self):
+        with self.lock:
+            return self._flush()
+
+    def find_the_last_attack(self, timestamp, info):
+        key = (info['attacker'], info['defender'], info['branch'])
+        with self.lock:
+            for row, other, _ in reversed(self.deferred):
+                if (other['attacker'], other['defender'], other['branch']) \
+                        == key and len(other['bugkind']) == 40 \
+                        and int(row.split(',', 1)[0]) >= timestamp:
+                    return other['bugkind']
+            return self.index.find(info['attacker'], info['defender'], \
+                    info['branch'], timestamp)
+
+    # Whether a row of `commit` stamped `stamp` is on the scoreboard or queued.
+    def has_row(self, stamp, info, commit):
+        key = (info['attacker'], info['defender'], info['branch'])
+        with self.lock:
+            for row, other, _ in self.deferred:
+                if (other['attacker'], other['defender'], other['branch']) \
+                        == key and other['bugkind'] == commit \
+                        and int(row.split(',', 1)[0]) == stamp:
+                    return True
+            return self.index.contains(info['attacker'], info['defender'], \
+                    info['branch'], stamp, commit)
+
+    # Push everything queued so far, then pull the score rows written by others.
+    def sync(self):
+        with self.lock:
+            if self._flush():
+                run_command('git pull --rebase origin master', self.path)
+                self.index.refresh()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.flush()
+        self.index.save()
+
+    def _run(self):
+        with self.lock:
+            while not self.closed:
+                if self.oldest is None:
+                    self.cond.wait()
+                    continue
+                remaining = self.oldest + self.max_delay - time.time()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self._flush()
+                if self.pending or self.unpushed:
+                    # Commit or push failed; retry after another delay.
+                    self.oldest = time.time()
+
+    def _add(self, row, info, pts):
+        with open(self.score_path, 'a') as f:
+            f.write(row)
+        self.index.refresh()
+        self.pending.append((row, dict(info), pts))
+        if self.oldest is None:
+            self.oldest = time.time()
+
+    def _commit(self, entries):
+        write_message([(info, pts) for _, info, pts in entries], self.path)
+        _, _, r = run_command('git add score.csv', self.path)
+        if r != 0:
+            print('[*] Failed to git add score.csv.')
+            return False
+        _, _, r = run_command('git commit -F %s' % msg_file, self.path)
+        rmfile(os.path.join(self.path, msg_file))
+        if r != 0:
+            print('[*] Failed to commit score.csv.')
+            return False
+        return True
+
+    # score.csv is append-only, so when a rebase conflicts our rows are simply
+    # replayed on top of the remote file.
+    def _rebase(self):
+        _, _, r = run_command('git pull --rebase origin master', self.path)
+        if r != 0:
+            run_command('git rebase --abort', self.path)
+            run_command('git reset --hard origin/master', self.path)
+            with open(self.score_path, 'a') as f:
+                for row, _, _ in self.unpushed:
+                    f.write(row)
+            if not self._commit(self.unpushed):
+                return False
+        self.index.refresh()
+        return True
+
+    def _flush(self):
+        while self.pushing:
+            self.cond.wait()
+        if self.pending:
+            if not self._commit(self.pending):
+                return False
+            self.unpushed.extend(self.pending)
+            self.pending = []
+        self.oldest = None
+        if not self.unpushed:
+            return True
+        self.pushing = True
+        try:
+            return self._push()
+        finally:
+            self.pushing = False
+            for row, info, pts in self.deferred:
+                self._add(row, info, pts)
+            self.deferred = []
+            self.cond.notify_all()
+
+    def _push(self):
+        for i in range(self.max_retries):
+            with span('scoreboard.push', rows=len(self.unpushed), attempt=i):
+                _, _, r = run_command('git push origin master', self.path)
+            if r == 0:
+                print('[*] Pushed %d score row(s).' % len(self.unpushed))
+                self.unpushed = []
+                self.index.save()
+                return True
+            print('[*] Failed to push the score. Rebasing (%d/%d).' % \
+                    (i + 1, self.max_retries))
+            # Back off without holding the lock, so that workers can keep
+            # recording their results meanwhile.
+            self.cond.wait(min(2 ** i, 30) * random.uniform(0.5, 1.0))
+            if not self._rebase():
+                break
+        print('[*] Giving up pushing for now; will retry on the next flush.')
+        return False
@@ -21,14 +21,28 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-if [ "$#" -ne 3 ]; then
-    echo "Usage: $0 [service name] [service port] [host port]"
+# The image is tagged with the service name unless given with -i.
+IMAGE=
+if [ "$1" = "-i" ]; then
+    IMAGE=$2
+    shift 2
+fi
+
+if [ "$#" -lt 3 ] || [ "$#" -gt 4 ]; then
+    echo "Usage: $0 (-i [image]) [service name] [service port] [host port] ([network])"
     exit 1
 fi
 SERVICE_NAME=$1
 CONTAINERPORT=$2
 HOSTPORT=$3
+NETWORK=$4
+IMAGE=${IMAGE:-$SERVICE_NAME}
 
-docker build -t $SERVICE_NAME .
+docker build -t $IMAGE .
 
-docker run --rm -d --name $SERVICE_NAME -p $HOSTPORT:$CONTAINERPORT $SERVICE_NAME
+# On a private network the service is not published on the host at all.
+if [ -z "$NETWORK" ]; then
+    docker run --rm -d --name $SERVICE_NAME -p $HOSTPORT:$CONTAINERPORT $IMAGE
+else
+    docker run --rm -d --name $SERVICE_NAME --network $NETWORK $IMAGE
+fi
@@ -63,7 +63,8 @@ def display_score(data, freq, unintended_pts, end_time, pin_time = None):
     history = set()
     num_solver = {}
     unint_attack_hist = {}
-    for row in reader:
+    # Rows pushed after a rebase can land below newer rows of other writers.
+    for row in sorted(reader, key=lambda row: float(row[0])):
         attacker, defender, branch, kind, points = row[1], row[2], row[3], \
                 row[4], int(row[5])
         attack_id = attacker + "_" + defender + "_" + branch
@@ -131,7 +132,8 @@ def show_score(token, config_file):
     end_time = config['end_time']
     start_time = config['start_time']
     path = get_github_path(scoreboard_url)
-    g = Github(config['player'], token)
+    g = Github(config['player'], token,
+               cache_dir=config.get('github_cache_dir'))
     if g.get('/repos/' + path) is None:
         print('[*] Failed to access the repository %s' % path)
         sys.exit()
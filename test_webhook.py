@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import print_function
+import hmac
+import json
+import hashlib
+import unittest
+import urllib.request
+import urllib.error
+from utils import iso8601_to_timestamp
+from webhook import WebhookReceiver
+
+SECRET = 'webhook-secret'
+
+# An `issues` delivery as sent by GitHub, trimmed to the fields we read.
+PAYLOAD = {
+    'action': 'opened',
+    'issue': {
+        'number': 7,
+        'title': 'exploit-bug1',
+        'state': 'open',
+        'user': {'login': 'attacker'},
+        'labels': [],
+        'created_at': '2018-05-02T09:12:44Z',
+        'updated_at': '2018-05-02T09:12:44Z',
+    },
+    'repository': {
+        'name': 'team1',
+        'full_name': 'gitctf/team1',
+    },
+    'sender': {'login': 'attacker'},
+}
+
+def sign(body, secret=SECRET):
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256)
+    return 'sha256=' + digest.hexdigest()
+
+class WebhookTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver = WebhookReceiver(0, SECRET, ['team1'], '127.0.0.1')
+        self.receiver.start()
+        self.url = 'http://127.0.0.1:%d/' % \
+                self.receiver.server.server_address[1]
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def post(self, payload, signature=None, event='issues'):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json',
+                   'X-GitHub-Event': event,
+                   'X-Hub-Signature-256': signature or sign(body)}
+        request = urllib.request.Request(self.url, body, headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=5)
+        except urllib.error.HTTPError as e:
+            return e.code
+        return response.getcode()
+
+    def test_signed_issue_is_queued(self):
+        self.assertEqual(self.post(PAYLOAD), 202)
+        gen_time = iso8601_to_timestamp(PAYLOAD['issue']['updated_at'])
+        self.assertEqual(self.receiver.queue.get_batch(1),
+                         [('team1', 7, None, gen_time)])
+
+    def test_bad_signature_is_rejected(self):
+        self.assertEqual(self.post(PAYLOAD, sign(b'{}', 'wrong')), 401)
+        self.assertEqual(self.receiver.queue.get_batch(0), [])
+
+    def test_other_repo_is_ignored(self):
+        payload = dict(PAYLOAD, repository={'name': 'team2'})
+        self.assertEqual(self.post(payload), 202)
+        self.assertEqual(self.receiver.queue.get_batch(0), [])
+
+if __name__ == '__main__':
+    unittest.main()
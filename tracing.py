@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import print_function
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Spans are appended as JSON lines to this file; None (the default) disables
+# tracing.
+trace_path = None
+trace_lock = threading.Lock()
+counter = [0]
+
+# The innermost open span. A context variable rather than a thread-local, so
+# that coroutines running on one thread each see their own spans.
+current = contextvars.ContextVar('current', default=None)
+
+def configure(path):
+    global trace_path
+    trace_path = path
+
+def next_id():
+    with trace_lock:
+        counter[0] += 1
+        return '%d-%d' % (os.getpid(), counter[0])
+
+class Span(object):
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.id = next_id()
+
+    # Add attributes known only once the span is running (e.g. a cache hit).
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+def emit(record):
+    line = json.dumps(record) + '\n'
+    with trace_lock:
+        with open(trace_path, 'a') as f:
+            f.write(line)
+
+# Time the enclosed block as a span named `name`. Spans opened inside it in
+# the same thread or task become its children. The status is 'ok', or the name
+# of the exception that left the block.
+@contextmanager
+def span(name, **attrs):
+    parent = current.get()
+    s = Span(name, attrs, parent.id if parent is not None else None)
+    token = current.set(s)
+    start = time.time()
+    status = 'ok'
+    try:
+        yield s
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        current.reset(token)
+        if trace_path is not None:
+            emit({'name': name, 'id': s.id, 'parent': s.parent,
+                  'start': start, 'duration': time.time() - start,
+                  'status': status, 'attrs': s.attrs})
+
+def load(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                pass # A line cut short by a crash
+    return spans
+
+# Nearest-rank percentile of an ascending list.
+def percentile(values, p):
+    rank = max(1, int(-(-len(values) * p // 100)))
+    return values[rank - 1]
+
+# Print, for each span name, how often it ran and the percentiles of its
+# duration, the phases taking the most time in total first.
+def report(path):
+    if not os.path.isfile(path):
+        print('[*] No trace file %s' % path)
+        return
+    durations = {}
+    for s in load(path):
+        durations.setdefault(s['name'], []).append(s['duration'])
+    print('%-24s %7s %9s %9s %9s %9s %10s' % \
+            ('phase', 'count', 'p50', 'p90', 'p99', 'max', 'total'))
+    for name in sorted(durations, key=lambda n: -sum(durations[n])):
+        values = sorted(durations[name])
+        print('%-24s %7d %9.2f %9.2f %9.2f %9.2f %10.1f' % \
+                (name, len(values), percentile(values, 50), \
+                 percentile(values, 90), percentile(values, 99), \
+                 values[-1], sum(values)))
@@ -34,13 +34,91 @@ import time
 import calendar
 import dateutil.parser
 import dateutil.tz
+import logging
+import logging.handlers
+from collections import deque
 from random import *
 from cmd import run_command
 
+COMMENT_BUDGET = 60000 # GitHub rejects comments over 65536 characters
+
+# Every verification log is also written in full to this logger, if
+# configure_verify_log() was called. Command outputs too long for it (e.g. of
+# exploits) are kept in full in `output_dir`, one file per verification.
+verify_logger = None
+verify_output_dir = None
+
+def configure_verify_log(path, max_bytes=10 * 1024 * 1024, backups=5,
+                         output_dir=None):
+    global verify_logger, verify_output_dir
+    verify_output_dir = output_dir
+    if output_dir is not None:
+        mkdir(output_dir)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, \
+            backupCount=backups)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    verify_logger = logging.getLogger('gitctf.verify')
+    verify_logger.setLevel(logging.INFO)
+    verify_logger.propagate = False
+    verify_logger.handlers = [handler]
+
+# The log of a verification, posted as an issue comment. Text is appended as
+# chunks; only the first and the last `budget / 2` characters are kept, so a
+# long log costs neither quadratic copying nor an oversized comment. The full
+# log goes to the verify log, each chunk prefixed with `name`.
+class LogSink(object):
+    def __init__(self, name, budget=COMMENT_BUDGET):
+        self.name = name
+        self.half = budget // 2
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def write(self, text):
+        if verify_logger is not None:
+            verify_logger.info('[%s] %s', self.name, text.rstrip('\n'))
+        room = self.half - self.head_size
+        if room > 0:
+            self.head.append(text[:room])
+            self.head_size += len(self.head[-1])
+            text = text[room:]
+        if not text:
+            return
+        self.tail.append(text)
+        self.tail_size += len(text)
+        while self.tail_size - len(self.tail[0]) >= self.half:
+            chunk = self.tail.popleft()
+            self.tail_size -= len(chunk)
+            self.dropped += len(chunk)
+
+    # The kept text, with a note where the middle was left out.
+    def summary(self):
+        tail = ''.join(self.tail)
+        dropped = self.dropped + max(0, len(tail) - self.half)
+        if dropped == 0:
+            return ''.join(self.head) + tail
+        return ''.join(self.head) + \
+            '\n[... %d characters omitted ...]\n' % dropped + \
+            tail[-self.half:]
+
+    def __str__(self):
+        return self.summary()
+
+    # Where full command outputs of this verification go, if anywhere.
+    @property
+    def output_path(self):
+        if verify_output_dir is None:
+            return None
+        name = re.sub(r'[^\w.-]', '_', self.name)
+        return os.path.join(verify_output_dir, name + '.out')
+
+# `log` is a LogSink, or None if the message is only printed.
 def print_and_log(msg, log=None):
     print(msg)
     if log != None:
-        log = log + msg + '\n'
+        log.write(msg + '\n')
     return log
 
 # Return alphanumeric random string of given length
@@ -96,6 +174,11 @@ def docker_cleanup(container_name):
     cmdline = "%s %s" % (script, container_name)
     run_command(cmdline, None)
 
+# Remove the specified docker image
+def docker_remove_image(image):
+    print("[*] Remove image '%s'" % image)
+    run_command("docker rmi %s" % image, None)
+
 def load_config(config_file):
     try:
         with open(config_file) as f:
@@ -30,15 +30,51 @@ from utils import prompt_checkout_warning, get_dirname, print_and_log, exit_main
 from cmd import run_command
 from git import checkout
 from crypto import encrypt_exploit
-import time
+import image_cache
+from image_cache import get_tree_key, get_flag_dst, get_image, create_service
+from image_cache import inject_flag, start_container, image_name
+from readiness import wait_for_container, get_probe, record_ready_time
+from allocator import lease
+from tracing import span
 
 #-*- coding: utf-8 -*-
 
 # TODO : Get these values via cmdline option
 SERVICE_IP = "127.0.0.1"
-SERVICE_PORT = 4000
+SERVICE_PORT = 4000 # Port the service listens on inside its container
 
-def start_service(service_dir, branch, container_name, flag_str, log=None):
+def start_cached_service(service_dir, key, flag_dst, container_name, flag_str,
+                         cache_size, host_port, network, log=None):
+    with span('image.get', key=key) as s:
+        image, hit = get_image(service_dir, key, cache_size)
+        s.set(cache_hit=hit)
+    if image is None:
+        return '', 'Failed to build the service image', 1, log
+    log = print_and_log("[*] Using %s image %s" % \
+            ("cached" if hit else "newly built", image), log)
+    # The flag is in place before the service process starts, so a service
+    # reading it at startup gets this job's flag. A returncode of None means
+    # the flag of the image could not be replaced, so the service has to be
+    # built without the cache.
+    with span('service.run', image=image):
+        output, err, e = create_service(image, container_name, SERVICE_PORT, \
+                host_port, network)
+        if e != 0:
+            return output, err, e, log
+        with span('service.flag'):
+            result = inject_flag(image, container_name, flag_dst, flag_str)
+        if result is None:
+            return output, err, None, log
+        _, err, e = result
+        if e != 0:
+            return output, err, e, log
+        _, err, e = start_container(container_name)
+    return output, err, e, log
+
+# Without the cache the image is built and tagged as `tag` (by default the
+# container name).
+def start_service(service_dir, branch, container_name, flag_str, host_port,
+                  network=None, log=None, tag=None):
 
     log= print_and_log("[*] Starting service from %s (branch '%s')" % \
             (service_dir, branch), log)
@@ -49,36 +85,81 @@ def start_service(service_dir, branch, container_name, flag_str, log=None):
     flag_path = os.path.join(service_dir, "flag") # Assumption in template
     if not os.path.isfile(flag_path):
         log = print_and_log("[*] 'flag' file not found in %s" % service_dir, log)
-        return False, log
+        return False, log, None
     with open(flag_path, "w") as flag_file:
         flag_file.write(flag_str)
 
-    # Run the service
-    script = os.path.join(base_dir(), "setup_service.sh")
-    cmdline = \
-        "%s %s %d %d" % (script, container_name, SERVICE_PORT, SERVICE_PORT)
-    output, err, e = run_command(cmdline, service_dir)
+    # Run the service, reusing the image built for an identical tree if the
+    # flag can be copied into the container before it starts.
+    cache_size = image_cache.cache_size
+    key = get_tree_key(service_dir) if cache_size > 0 else None
+    flag_dst = get_flag_dst(service_dir) if key is not None else None
+    if flag_dst is not None:
+        image = image_name(key)
+        output, err, e, log = start_cached_service(service_dir, key, flag_dst, \
+                container_name, flag_str, cache_size, host_port, network, log)
+        if e is None:
+            log = print_and_log("[*] Flag of %s is not a regular file; " \
+                    "building without the cache" % image, log)
+            docker_cleanup(container_name)
+            flag_dst = None
+    if flag_dst is None:
+        image = tag if tag is not None else container_name
+        script = os.path.join(base_dir(), "setup_service.sh")
+        cmdline = "%s -i %s %s %d %d" % \
+            (script, image, container_name, SERVICE_PORT, host_port)
+        if network is not None:
+            cmdline += " %s" % network
+        with span('service.build_and_run', cache_hit=False):
+            output, err, e = run_command(cmdline, service_dir)
     if e != 0:
         log = print_and_log("[*] Failed to start service", log)
         log = print_and_log(err, log)
         log = print_and_log("==========================", log)
-        return False, log
+        return False, log, image
     if log is not None:
-        log = log + output
+        log.write(output)
 
     log = print_and_log("[*] Started service successfully", log)
-    return True, log
+    return True, log, image
 
-def run_exploit(exploit_dir, container_name, timeout, log=None):
+def wait_for_service(image, container_name, repo_name, config, log=None):
+    deadline = config.get('ready_timeout', 30)
+    with span('service.ready', repo=repo_name) as s:
+        elapsed = wait_for_container(container_name, SERVICE_PORT, deadline, \
+                get_probe(config, repo_name))
+        s.set(ready=elapsed is not None)
+    if elapsed is None:
+        log = print_and_log("[*] Service readiness not confirmed, " \
+                "running the exploit anyway", log)
+    else:
+        log = print_and_log("[*] Service ready in %.2f seconds" % elapsed, log)
+        record_ready_time(image, elapsed)
+    return log
+
+def run_exploit(exploit_dir, container_name, timeout, ip=SERVICE_IP,
+                port=SERVICE_PORT, network=None, log=None, tag=None):
     log = print_and_log("[*] Running exploit", log)
 
     script = os.path.join(base_dir(), "launch_exploit.sh")
     cmdline = \
-      "%s %s %s %d %d" % \
-      (script, container_name, SERVICE_IP, SERVICE_PORT, timeout)
-    output, err, e = run_command(cmdline, exploit_dir)
+      "%s -i %s %s %s %d %d" % \
+      (script, tag if tag is not None else container_name, container_name, \
+       ip, port, timeout)
+    if network is not None:
+        cmdline += " %s" % network
+    # Not echoed when it goes to the log: a misbehaving exploit may print a
+    # lot. The log keeps its head and tail, and the full output is teed to the
+    # output file of the verification.
+    tee = log.output_path if log is not None else None
+    if tee is not None:
+        log = print_and_log("[*] Full exploit output: %s" % tee, log)
+    with span('exploit.run', timeout=timeout) as s:
+        output, err, e = run_command(cmdline, exploit_dir, \
+                quiet=log is not None, tee=tee)
+        s.set(returncode=e)
     if log is not None:
-        log = log + output
+        log.write(output)
 
     if e != 0:
         log = print_and_log("[*] Failed to run exploit", log)
@@ -104,25 +185,43 @@ def verify_exploit(exploit_dir, service_dir, branch, timeout, config,
     # Create random flag value
     flag = random_string(10)
 
-    # Start the service
+    # Every job gets its own host port and container names. With a private
+    # network, the service is not published on the host and the network is
+    # internal, so only the paired exploit container can reach the service.
     service_dirname = get_dirname(service_dir)
-    service_container_name = "%s-%s" % (service_dirname, branch.replace('/', '_'))
-    result, log = start_service(service_dir, branch, service_container_name, \
-            flag, log=log)
-    if not result:
-        return False, log
+    private_network = config.get('private_network', False) if config else False
+    prefix = "%s-%s" % (service_dirname, branch)
+    with lease(prefix, private_network) as job, \
+            span('verify_exploit', service=service_dirname, commit=branch):
+        # Start the service
+        result, log, image = start_service(service_dir, branch, \
+                job.service_name, flag, job.host_port, job.network, log=log, \
+                tag=job.service_image)
+        if not result:
+            docker_cleanup(job.service_name)
+            return False, log
 
-    time.sleep(2)
+        log = wait_for_service(image, job.service_name, service_dirname, \
+                config, log)
 
-    # Run the exploit
-    exploit_dirname = get_dirname(exploit_dir)
-    exploit_container_name = "exploit-%s" % branch.replace('/', '_')
-    exploit_result, log = run_exploit(exploit_dir, exploit_container_name, \
-            timeout, log=log)
+        # Run the exploit
+        if job.network is None:
+            ip, port = SERVICE_IP, job.host_port
+        else:
+            ip, port = job.service_name, SERVICE_PORT
+        exploit_result, log = run_exploit(exploit_dir, job.exploit_name, \
+                timeout, ip, port, job.network, log=log, \
+                tag=job.exploit_image)
 
-    # Clean up containers
-    docker_cleanup(service_container_name)
-    docker_cleanup(exploit_container_name)
+        # Clean up the containers. The images are kept for the layer cache;
+        # with the image cache on, its bound covers them as well.
+        with span('cleanup'):
+            docker_cleanup(job.service_name)
+            docker_cleanup(job.exploit_name)
+            if image_cache.cache_size > 0:
+                if image == job.service_image:
+                    image_cache.touch(image, image_cache.cache_size)
+                image_cache.touch(job.exploit_image, image_cache.cache_size)
 
     log = print_and_log("[*] Exploit returned : %s" % exploit_result, log)
     log = print_and_log("[*] Solution flag : %s" % flag, log)
@@ -46,7 +46,7 @@ def verify_injection(team, config_file):
     repo_owner = config['repo_owner']
     repo_name = config['teams'][team]['repo_name']
     bug_branches = config['teams'][team]['bug_branches']
-    clone(repo_owner, repo_name)
+    clone(repo_owner, repo_name, cached=True)
     branches = bug_branches if len(bug_branches) > 0 \
         else list_branches(repo_name)
     if "master" in branches:
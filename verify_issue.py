@@ -26,7 +26,7 @@ import sys
 import json
 import os
 from utils import load_config, rmfile, mkdir, random_string, rmdir
-from utils import prompt_checkout_warning, print_and_log
+from utils import prompt_checkout_warning, print_and_log, LogSink
 from git import list_branches, clone, checkout
 from git import get_latest_commit_hash
 from issue import get_github_issue
@@ -35,17 +35,16 @@ from verify_exploit import verify_exploit
 from github import Github
 from datetime import datetime
 from cmd import run_command
+from tracing import span
 
-def verify_issue(defender, repo_name, issue_no, config, github, target_commit=None):
-    timeout = config["exploit_timeout"]["exercise_phase"]
+# `issue` is an IssueSnapshot already fetched by the caller, if any.
+def fetch_exploit(defender, repo_name, issue_no, config, github, issue=None):
     repo_owner = config['repo_owner']
-    title, submitter, create_time, content = \
-        get_github_issue(repo_owner, repo_name, issue_no, github)
-
-    # Issue convention: "exploit-[branch_name]"
-    target_branch = title[8:]
-
-    clone(repo_owner, repo_name)
+    if issue is None:
+        title, submitter, create_time, content = \
+            get_github_issue(repo_owner, repo_name, issue_no, github)
+    else:
+        title, submitter, create_time, content = issue.as_tuple()
 
     # Write the fetched issue content to temp file
     tmpfile = "/tmp/gitctf_%s.issue" % random_string(6)
@@ -57,10 +56,32 @@ def verify_issue(defender, repo_name, issue_no, config, github, target_commit=No
     # Decrypt the exploit
     mkdir(tmpdir)
 
-    team = defender
-    decrypt_exploit(tmpfile, config, team, tmpdir, submitter)
+    with span('decrypt', repo=repo_name, attacker=submitter):
+        decrypt_exploit(tmpfile, config, defender, tmpdir, submitter)
     rmfile(tmpfile)
 
+    return (title, submitter, create_time, tmpdir)
+
+# An exploit already decrypted by fetch_exploit() can be passed in as `exploit`.
+# In that case the caller keeps ownership of the exploit directory.
+def verify_issue(defender, repo_name, issue_no, config, github, \
+        target_commit=None, exploit=None):
+    timeout = config["exploit_timeout"]["exercise_phase"]
+    repo_owner = config['repo_owner']
+    if exploit is None:
+        title, submitter, create_time, tmpdir = \
+            fetch_exploit(defender, repo_name, issue_no, config, github)
+    else:
+        title, submitter, create_time, tmpdir = exploit
+
+    # Issue convention: "exploit-[branch_name]"
+    target_branch = title[8:]
+
+    with span('clone', repo=repo_name):
+        clone(repo_owner, repo_name, cached=True)
+
+    team = defender
+
     # Now iterate through branches and verify exploit
     # zchn: not sure about this, was: branches = list_branches(repo_name)
     bug_branches = config['teams'][team]['bug_branches']
@@ -76,22 +97,27 @@ def verify_issue(defender, repo_name, issue_no, config, github, target_commit=No
     verified_branch = None
     verified_commit = None
 
-    log = 'About %s (exploit-service branch)\n' % title
+    log = LogSink('%s#%s' % (repo_name, issue_no))
+    log.write('About %s (exploit-service branch)\n' % title)
 
     for (branch, commit) in candidates:
-        if branch in title:
-            result, log = verify_exploit(tmpdir, repo_name, commit, timeout, \
-                    config, log=log)
-        else:
-            result, _ = verify_exploit(tmpdir, repo_name, commit, timeout, \
-                    config)
+        with span('verify_issue', repo=repo_name, branch=branch, \
+                commit=commit, attacker=submitter) as s:
+            if branch in title:
+                result, log = verify_exploit(tmpdir, repo_name, commit, \
+                        timeout, config, log=log)
+            else:
+                result, _ = verify_exploit(tmpdir, repo_name, commit, \
+                        timeout, config)
+            s.set(verified=result)
 
         if result:
             verified_branch = branch
             verified_commit = commit
             break
 
-    rmdir(tmpdir)
+    if exploit is None:
+        rmdir(tmpdir)
     rmdir(repo_name)
 
     if verified_branch is None:
@@ -24,10 +24,10 @@
 from __future__ import print_function
 import os
 import sys
-import time
 from cmd import run_command
 from git import clone, checkout
 from utils import base_dir, rmdir, docker_cleanup, load_config
+from readiness import wait_for_container
 
 def setup(repo_name, container_name, service_port, host_port):
     script = os.path.join(base_dir(), "setup_service.sh")
@@ -38,26 +38,24 @@ def setup(repo_name, container_name, service_port, host_port):
         print(err)
         sys.exit()
 
-def check_liveness(container_name, host_port):
-    for _ in range(3):
-        _, _, e = run_command('nc -z 127.0.0.1 %d' % host_port, None)
-        if e != 0:
-            print("[*] %s service is not running. e = %d." % (container_name, e))
-            time.sleep(1)
-        else:
-            print("[*] %s service looks well." % container_name)
-            break
+def check_liveness(container_name, service_port, deadline=3):
+    elapsed = wait_for_container(container_name, service_port, deadline)
+    if elapsed is None:
+        print("[*] %s service is not running." % container_name)
+    else:
+        print("[*] %s service looks well (ready in %.2f seconds)." % \
+                (container_name, elapsed))
 
 def verify_service(team, branch, service_port, host_port, config_file):
     config = load_config(config_file)
     repo_owner = config['repo_owner']
     repo_name = config['teams'][team]['repo_name']
     container_name = "%s-%s" % (repo_name, branch)
-    clone(repo_owner, repo_name)
+    clone(repo_owner, repo_name, cached=True)
     docker_cleanup(container_name)
     checkout(repo_name, branch)
     setup(repo_name, container_name, int(service_port), int(host_port))
-    check_liveness(container_name, int(host_port))
+    check_liveness(container_name, int(service_port))
     docker_cleanup(container_name)
     rmdir(repo_name)
     sys.exit()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+###############################################################################
+# Git-based CTF
+###############################################################################
+#
+# Author: SeongIl Wi <seongil.wi@kaist.ac.kr>
+#         Jaeseung Choi <jschoi17@kaist.ac.kr>
+#         Sang Kil Cha <sangkilc@kaist.ac.kr>
+#
+# Copyright (c) 2018 SoftSec Lab. KAIST
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from __future__ import print_function
+from future import standard_library
+standard_library.install_aliases()
+import hmac
+import json
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from utils import iso8601_to_timestamp
+
+# Issue events that may carry a new exploit.
+ISSUE_ACTIONS = ['opened', 'reopened', 'edited']
+
+def verify_signature(secret, body, signature):
+    if signature is None or not signature.startswith('sha256='):
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest('sha256=' + digest, str(signature))
+
+# Turn an `issues` payload into the (repo, num, id, gen_time) tuple that
+# evaluate.process_issue() consumes. Webhooks do not know the notification
+# thread, so `id` is None.
+def parse_issue_event(payload, target_repos):
+    if payload.get('action') not in ISSUE_ACTIONS:
+        return None
+    repo = payload['repository']['name']
+    if repo not in target_repos:
+        return None
+    issue = payload['issue']
+    if 'pull_request' in issue:
+        return None
+    gen_time = iso8601_to_timestamp(issue['updated_at'])
+    return (repo, int(issue['number']), None, gen_time)
+
+# Pending issues in arrival order. An issue queued twice before being taken is
+# only processed once; a notification thread id, if any, is kept.
+class IssueQueue(object):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.index = {}
+
+    def put(self, issue):
+        with self.cond:
+            key = (issue[0], issue[1])
+            if key in self.index:
+                i = self.index[key]
+                if issue[2] is not None:
+                    self.pending[i] = issue
+                return
+            self.index[key] = len(self.pending)
+            self.pending.append(issue)
+            self.cond.notify()
+
+    # Wait up to `timeout` seconds for issues and take all of them.
+    def get_batch(self, timeout):
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            issues = self.pending
+            self.pending = []
+            self.index = {}
+            return issues
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def reply(self, code, msg):
+        body = msg.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        signature = self.headers.get('X-Hub-Signature-256')
+        if not verify_signature(receiver.secret, body, signature):
+            return self.reply(401, 'bad signature')
+        event = self.headers.get('X-GitHub-Event')
+        if event == 'ping':
+            return self.reply(200, 'pong')
+        if event != 'issues':
+            return self.reply(202, 'ignored')
+        try:
+            issue = parse_issue_event(json.loads(body.decode('utf-8')), \
+                    receiver.target_repos)
+        except (ValueError, KeyError) as e:
+            return self.reply(400, 'malformed payload: %r' % e)
+        if issue is None:
+            return self.reply(202, 'ignored')
+        print('[*] Webhook: issue #%d of %s' % (issue[1], issue[0]))
+        receiver.queue.put(issue)
+        return self.reply(202, 'queued')
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class WebhookReceiver(object):
+    def __init__(self, port, secret, target_repos, host='0.0.0.0'):
+        self.secret = secret
+        self.target_repos = target_repos
+        self.queue = IssueQueue()
+        self.server = ThreadingHTTPServer((host, port), WebhookHandler)
+        self.server.receiver = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        print('[*] Listening for webhooks on port %d' % \
+                self.server.server_address[1])
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='receive issue webhooks ' \
+            'and print the queued issues')
+    parser.add_argument("-p", "--port", metavar="NUM", type=int, default=8080,
+                        help="specify the port to listen on (default: 8080)")
+    parser.add_argument("-s", "--secret", metavar="string", required=True,
+                        help="specify the webhook secret")
+    parser.add_argument("-r", "--repo", metavar="string", action="append",
+                        required=True, help="specify a target repo")
+    args = parser.parse_args()
+    receiver = WebhookReceiver(args.port, args.secret, args.repo)
+    receiver.start()
+    try:
+        while True:
+            for issue in receiver.queue.get_batch(60):
+                print(issue)
+    except KeyboardInterrupt:
+        receiver.stop()